@@ -35,11 +35,11 @@ for idx in range(len(speakers)):
     for digit in digits:
         for repetition in repetitions:
             filename = os.path.join(tidigitsroot, genders[idx], speakers[idx], digit+repetition+'.wav')
-            sndobj = sndio.read(filename)
-            # libsndfile scales the values down to the -1.0 +1.0 range
-            # here we convert back to the range of 16 bit linear PCM
+            # keep the 16 bit linear PCM samples, enframe scales them as
+            # libsndfile floats (-1.0 +1.0 range) times the int16 maximum,
             # to get similar results as from Kaldi or HTK
-            samples = np.array(sndobj[0])*np.iinfo(np.int16).max
+            sndobj = sndio.read(filename, dtype=np.int16)
+            samples = np.array(sndobj[0], dtype=np.int16)
             samplingrate = sndobj[1]
             data.append({"filename": filename,
                          "samplingrate": samplingrate,
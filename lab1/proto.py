@@ -2,12 +2,9 @@
 
 # Function given by the exercise ----------------------------------
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.signal import lfilter, hamming
 from lab1.tools import *
-from scipy.fftpack import fft
-from scipy.fftpack.realtransforms import dct
-import scipy
+# scipy and matplotlib are imported in the functions that use them, so that
+# importing this module stays cheap
 def mfcc(samples, winlen = 400, winshift = 200, preempcoeff=0.97, nfft=512, nceps=13, samplingrate=20000, liftercoeff=22, liftering = True):
     """Computes Mel Frequency Cepstrum Coefficients.
 
@@ -47,6 +44,45 @@ def mfcc(samples, winlen = 400, winshift = 200, preempcoeff=0.97, nfft=512, ncep
         return liftered, mspec
 
 
+class OnlineMfcc:
+    """Computes MFCCs on a stream of samples, chunk by chunk.
+
+    Samples that do not fill a whole window yet are kept until the next chunk,
+    so the concatenated output is the same as mfcc() on the whole signal.
+
+    Example:
+        features = OnlineMfcc()
+        for chunk in chunks:
+            lmfcc = features.push(chunk)  # may have zero rows
+    """
+
+    def __init__(self, winlen=400, winshift=200, preempcoeff=0.97, nfft=512, nceps=13, samplingrate=20000, liftercoeff=22):
+        self.winlen = winlen
+        self.winshift = winshift
+        self.preempcoeff = preempcoeff
+        self.nfft = nfft
+        self.nceps = nceps
+        self.samplingrate = samplingrate
+        self.liftercoeff = liftercoeff
+        self.buffer = np.zeros(0, dtype=np.int16)
+
+    def push(self, samples):
+        """
+        Args:
+            samples: array of new speech samples
+        Returns:
+            N x nceps array of liftered MFCCs for the windows completed by these samples
+        """
+        self.buffer = np.concatenate((self.buffer, samples))
+        if len(self.buffer) < self.winlen:
+            return np.zeros((0, self.nceps))
+        frames = enframe(self.buffer, self.winlen, self.winshift)
+        self.buffer = self.buffer[len(frames) * self.winshift:]
+        spec = powerSpectrum(windowing(preemp(frames, self.preempcoeff)), self.nfft)
+        ceps = cepstrum(logMelSpectrum(spec, self.samplingrate), self.nceps)
+        return lifter(ceps, self.liftercoeff)
+
+
 # Functions to be implemented ----------------------------------
 
 def enframe(samples, winlen, winshift):
@@ -59,6 +95,11 @@ def enframe(samples, winlen, winshift):
     Returns:
         numpy array [N x winlen], where N is the number of windows that fit
         in the input signal
+
+    int16 samples (as returned by loadAudio) are converted to float here, one
+    utterance or chunk at a time, with the same scale as the float samples
+    used to train the models: libsndfile's [-1, 1] range times the int16
+    maximum, that is int16 * 32767/32768.
     """
 
     start = 0
@@ -74,6 +115,8 @@ def enframe(samples, winlen, winshift):
         start += winshift
 
     npframes = np.vstack(frames)
+    if np.issubdtype(npframes.dtype, np.integer):
+        npframes = npframes * (np.iinfo(np.int16).max / -float(np.iinfo(np.int16).min))
 
     # plotting
     #plot_sub(npframes, 'Enframe', 2)
@@ -94,6 +137,7 @@ def preemp(input, p=0.97):
         output: array of pre-emphasised speech samples
     Note (you can use the function lfilter from scipy.signal)
     """
+    from scipy.signal import lfilter
     emphasized = lfilter([1, -p], 1, input)
 
     # plotting
@@ -114,6 +158,7 @@ def windowing(input):
     Note (you can use the function hamming from scipy.signal, include the sym=0 option
     if you want to get the same results as in the example)
     """
+    from scipy.signal.windows import hamming
     window = hamming(input.shape[1], sym=0)
     npwindows = np.multiply(input, window)
 
@@ -134,6 +179,7 @@ def powerSpectrum(input, nfft):
         array of power spectra [N x nfft]
     Note: you can use the function fft from scipy.fftpack
     """
+    from scipy.fftpack import fft
     freqDom = fft(input,nfft)
     absVal = np.absolute(freqDom)
     retVal = np.square(absVal)
@@ -165,7 +211,7 @@ def logMelSpectrum(input, samplingrate):
     #plt.plot(input[1], linewidth=0.3, color='lightgrey')
     #plt.plot(bank.T, linewidth=0.5, color='blue')
 
-    sample_out = input[1].dot(bank.T)
+    #sample_out = input[1].dot(bank.T)
     #plt.plot(sample_out, linewidth=1, color='green')
 
     #plt.xlim((0,200))
@@ -197,6 +243,7 @@ def cepstrum(input, nceps):
     Note: you can use the function dct from scipy.fftpack.realtransforms
     """
 
+    from scipy.fftpack.realtransforms import dct
     out = dct(input, norm='ortho')
     out = out[:, 0:13]
 
@@ -208,6 +255,7 @@ def cepstrum(input, nceps):
 def plot_sub(data, title, count):
 
     # plotting
+    import matplotlib.pyplot as plt
     ax = plt.subplot(8, 1, count)
     ax.set_yticklabels([])
     ax.set_xticklabels([])
@@ -276,6 +324,7 @@ def compareUtterances(data):
     ii = np.load('insurance d.txt.npy')
     D = DD + DD.T
     #np.save('insurance d.txt', D)
+    import matplotlib.pyplot as plt
     plt.pcolormesh(D)
     #plt.savefig()
     plt.show()
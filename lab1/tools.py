@@ -90,10 +90,10 @@ def trfbank(fs, nfft, lowfreq=133.33, linsc=200/3., logsc=1.0711703, nlinfilt=13
         hi = freqs[i+2]
 
         lid = np.arange(np.floor(low * nfft / fs) + 1,
-                        np.floor(cen * nfft / fs) + 1, dtype=np.int)
+                        np.floor(cen * nfft / fs) + 1, dtype=int)
         lslope = heights[i] / (cen - low)
         rid = np.arange(np.floor(cen * nfft / fs) + 1,
-                        np.floor(hi * nfft / fs) + 1, dtype=np.int)
+                        np.floor(hi * nfft / fs) + 1, dtype=int)
         rslope = heights[i] / (hi - cen)
         fbank[i][lid] = lslope * (nfreqs[lid] - low)
         fbank[i][rid] = rslope * (hi - nfreqs[rid])
@@ -0,0 +1,234 @@
+import numpy as np
+from lab2.tools2 import logsumexp
+
+
+def padUtterances(utterances):
+    """ Stacks utterances of different length into one padded array
+
+    Args:
+       utterances: list of U arrays of shape NxD (N can differ)
+
+    Output:
+       X: UxTxD array where T is the length of the longest utterance,
+          frames after the end of an utterance are zero
+       lengths: array with the number of frames N of each utterance
+    """
+    lengths = np.array([len(x) for x in utterances])
+    X = np.zeros((len(utterances), lengths.max(), utterances[0].shape[1]))
+    for u, x in enumerate(utterances):
+        X[u, :len(x)] = x
+    return X, lengths
+
+
+def padModels(hmms):
+    """ Stacks HMM models with different number of states into padded arrays
+
+    Args:
+       hmms: list of W models as returned by concatHMMs
+
+    Output:
+       log_startprob: WxM array of log start probabilities
+       log_transmat: WxMxM array of log transition probabilities between the
+                     emitting states (the non emitting exit state is dropped)
+       where M is the largest number of emitting states. Padded states have
+       probability zero (-inf), so they can never be visited.
+    """
+    nstates = [hmm['means'].shape[0] for hmm in hmms]
+    M = max(nstates)
+    log_startprob = np.full((len(hmms), M), -np.inf)
+    log_transmat = np.full((len(hmms), M, M), -np.inf)
+    with np.errstate(divide='ignore'):
+        for w, hmm in enumerate(hmms):
+            m = nstates[w]
+            log_startprob[w, :m] = np.log(np.ravel(hmm['startprob'])[:m])
+            log_transmat[w, :m, :m] = np.log(hmm['transmat'][:m, :m])
+    return log_startprob, log_transmat
+
+
+def batchLoglik(emissions, X, namelists):
+    """ Emission log likelihoods for every utterance and every model
+
+    Args:
+       emissions: EmissionCache for the phone models
+       X: UxTxD array of padded utterances (see padUtterances)
+       namelists: list of W phone name lists, one per concatenated model
+
+    Output:
+       log_emlik: UxWxTxM array of emission log likelihoods, -inf for
+                  padded states
+    """
+    U, T, D = X.shape
+    obsloglik = emissions.update(X.reshape(U * T, D)).reshape(U, T, -1)
+    indices = [emissions.indices(names) for names in namelists]
+    M = max(len(idx) for idx in indices)
+    log_emlik = np.full((U, len(namelists), T, M), -np.inf)
+    for w, idx in enumerate(indices):
+        log_emlik[:, w, :, :len(idx)] = obsloglik[:, :, idx]
+    return log_emlik
+
+
+def batchViterbi(log_emlik, lengths, log_startprob, log_transmat, paths=False):
+    """Viterbi scores for many utterances and many models at once.
+
+    Args:
+        log_emlik: UxWxTxM array of emission log likelihoods for U utterances,
+                   W models, T frames (padded) and M states (padded)
+        lengths: array with the number of valid frames of each utterance
+        log_startprob: WxM array of log start probabilities
+        log_transmat: WxMxM array of log transition probabilities
+        paths: if True, also return the best paths
+
+    Output:
+        viterbi_loglik: UxW table with the log likelihood of the best path
+        viterbi_path: (only if paths is True) UxWxT array of best paths,
+                      -1 after the end of each utterance
+    """
+    U, W, T, M = log_emlik.shape
+    lengths = np.asarray(lengths)
+    delta = log_startprob[None] + log_emlik[:, :, 0]
+    if paths:
+        B = np.zeros((T, U, W, M), dtype=np.min_scalar_type(M - 1))
+
+    for t in range(1, T):
+        scores = delta[..., :, None] + log_transmat[None]
+        best = np.argmax(scores, axis=2)
+        new = np.take_along_axis(scores, best[:, :, None, :], axis=2)[:, :, 0] + log_emlik[:, :, t]
+        # Utterances that already ended keep their last scores
+        delta = np.where((t < lengths)[:, None, None], new, delta)
+        if paths:
+            B[t] = best
+
+    viterbi_loglik = np.max(delta, axis=2)
+    if not paths:
+        return viterbi_loglik
+
+    # Trace back all the utterances and models together
+    state = np.argmax(delta, axis=2)
+    viterbi_path = np.full((U, W, T), -1)
+    u, w = np.indices((U, W))
+    for t in range(T - 1, 0, -1):
+        active = (t < lengths)[:, None]
+        viterbi_path[:, :, t] = np.where(active, state, -1)
+        state = np.where(active, B[t, u, w, state], state)
+    viterbi_path[:, :, 0] = state
+    return viterbi_loglik, viterbi_path
+
+
+def batchForward(log_emlik, lengths, log_startprob, log_transmat):
+    """Forward log likelihoods for many utterances and many models at once.
+
+    Args:
+        log_emlik: UxWxTxM array of emission log likelihoods for U utterances,
+                   W models, T frames (padded) and M states (padded)
+        lengths: array with the number of valid frames of each utterance
+        log_startprob: WxM array of log start probabilities
+        log_transmat: WxMxM array of log transition probabilities
+
+    Output:
+        loglik: UxW table with the log likelihood of each utterance given
+                each model, that is logsumexp of the last forward vector
+    """
+    lengths = np.asarray(lengths)
+    alpha = log_startprob[None] + log_emlik[:, :, 0]
+    for t in range(1, log_emlik.shape[2]):
+        new = logsumexp(alpha[..., :, None] + log_transmat[None], axis=2) + log_emlik[:, :, t]
+        alpha = np.where((t < lengths)[:, None, None], new, alpha)
+    return logsumexp(alpha, axis=2)
+
+
+def lengthBuckets(lengths, nstates, maxWaste=0.25, maxCells=2**24):
+    """ Groups utterances of similar size for batch processing
+
+    The utterances are sorted by number of frames (and of states), and a
+    bucket grows as long as padding it to its longest utterance and largest
+    model wastes at most maxWaste of its cells, and its padded size stays
+    below maxCells.
+
+    Args:
+       lengths: array with the number of frames of each utterance
+       nstates: array with the number of states of the model of each
+                utterance (1 if the models are not padded)
+       maxWaste: largest fraction of padded cells in a bucket
+       maxCells: largest number of padded frames x states in a bucket. Batch
+                 alignment uses about 10 bytes per cell
+
+    Output:
+       list of arrays with the indices of the utterances in each bucket
+    """
+    lengths, nstates = np.asarray(lengths), np.asarray(nstates)
+    buckets = []
+    current = []
+    used = 0
+    T = S = 0
+    for i in np.lexsort((nstates, lengths)):
+        t, s = max(T, lengths[i]), max(S, nstates[i])
+        cells = (len(current) + 1) * t * s
+        size = lengths[i] * nstates[i]
+        if current and (cells > maxCells or 1 - (used + size) / cells > maxWaste):
+            buckets.append(np.array(current))
+            current = []
+            used = 0
+            t, s = lengths[i], nstates[i]
+        current.append(i)
+        used += size
+        T, S = t, s
+    if current:
+        buckets.append(np.array(current))
+    return buckets
+
+
+def batchBandedViterbi(log_emlik, lengths, nstates, log_startprob, offsets, log_band):
+    """Banded Viterbi alignment of many utterances at once.
+
+    Same as bandedViterbi with final=True, for U utterances padded to T
+    frames, each with its own model padded to M states.
+
+    Args:
+        log_emlik: UxTxM array of emission log likelihoods, -inf for padded
+                   states
+        lengths: array with the number of valid frames of each utterance
+        nstates: array with the number of states of each model, the path of
+                 utterance u ends in state nstates[u] - 1
+        log_startprob: UxM array of log start probabilities
+        offsets: K array of diagonal offsets shared by all the models
+        log_band: UxKxM array of log transition probabilities, see
+                  transitionBand
+
+    Output:
+        viterbi_loglik: U array with the log likelihood of each best path
+        viterbi_path: UxT array of best paths, -1 after the end of each
+                      utterance
+
+    Utterances whose last state cannot be reached (too short for their
+    model, see minimumFrames) get a -inf log likelihood and a path of -1,
+    without stopping the alignment of the others.
+    """
+    U, T, M = log_emlik.shape
+    lengths, nstates = np.asarray(lengths), np.asarray(nstates)
+    pad = max(0, np.max(offsets))
+    sources = np.arange(M)[None, :] - offsets[:, None] + pad
+    padded = np.full((U, M + pad + max(0, -np.min(offsets))), -np.inf)
+    B = np.zeros((T, U, M), dtype=np.min_scalar_type(len(offsets) - 1))
+
+    delta = log_startprob + log_emlik[:, 0]
+    for t in range(1, T):
+        padded[:, pad:pad + M] = delta
+        scores = padded[:, sources] + log_band
+        best = np.argmax(scores, axis=1)
+        B[t] = best
+        new = np.take_along_axis(scores, best[:, None, :], axis=1)[:, 0] + log_emlik[:, t]
+        # Utterances that already ended keep their last scores
+        delta = np.where((t < lengths)[:, None], new, delta)
+
+    u = np.arange(U)
+    state = nstates - 1
+    viterbi_loglik = delta[u, state]
+    # the backpointers are only followed on paths with a finite score
+    found = np.isfinite(viterbi_loglik)
+    viterbi_path = np.full((U, T), -1)
+    for t in range(T - 1, 0, -1):
+        active = found & (t < lengths)
+        viterbi_path[active, t] = state[active]
+        state = np.where(active, state - offsets[B[t, u, state]], state)
+    viterbi_path[found, 0] = state[found]
+    return viterbi_loglik, viterbi_path
@@ -0,0 +1,214 @@
+import numpy as np
+
+
+def phoneStateBank(phoneHMMs):
+    """ Stacks the emitting states of all phone models into a single bank
+
+    Args:
+       phoneHMMs: dictionary of phonetic Gaussian HMM models
+
+    Output:
+       stateList: list of S state names in the form phone_index
+       means: SxD array of mean vectors for all the states
+       covars: SxD array of variances for all the states
+
+    The phones are sorted by name, which gives the same state order as the
+    stateList used in lab 3.
+    """
+    phones = sorted(phoneHMMs.keys())
+    stateList = [ph + '_' + str(id) for ph in phones
+                 for id in range(phoneHMMs[ph]['means'].shape[0])]
+    means = np.vstack([phoneHMMs[ph]['means'] for ph in phones])
+    covars = np.vstack([phoneHMMs[ph]['covars'] for ph in phones])
+    return stateList, means, covars
+
+
+class GaussianBank:
+    """ Diagonal Gaussian densities with the model terms precomputed
+
+    The log density of a diagonal Gaussian is
+
+       -0.5 * (D*log(2*pi) + sum(log(covars)) + sum(means**2/covars))
+       + X.(means/covars) - 0.5 * X**2.(1/covars)
+
+    where only the last two terms depend on the data. The constant and the
+    weights of [X, X**2] are computed once, so evaluating all the states is
+    a single matrix product, the same as log_multivariate_normal_density_diag.
+
+    Example:
+       bank = GaussianBank(means, covars)
+       obsloglik = bank.loglik(lmfcc)
+    """
+
+    def __init__(self, means, covars, dtype=np.float64):
+        """
+        Args:
+           means: SxD array of mean vectors
+           covars: SxD array of variances
+           dtype: float type of the computation, np.float32 is about twice as
+                  fast with an error well below the differences between states
+        """
+        precision = 1.0 / covars
+        self.dtype = dtype
+        self.const = (-0.5 * (means.shape[1] * np.log(2 * np.pi) + np.sum(np.log(covars), 1)
+                              + np.sum(means**2 * precision, 1))).astype(dtype)
+        self.weights = np.vstack([(means * precision).T, -0.5 * precision.T]).astype(dtype)
+
+    def loglik(self, X, states=None):
+        """ Log densities of the feature vectors
+
+        Args:
+           X: NxD array of feature vectors
+           states: optional array of state indices, only these columns are
+                   computed
+
+        Output:
+           NxS array of log likelihoods (or one column per state in states)
+        """
+        X = np.asarray(X, dtype=self.dtype)
+        features = np.hstack([X, X**2])
+        if states is None:
+            return features.dot(self.weights) + self.const
+        return features.dot(self.weights[:, states]) + self.const[states]
+
+
+class GaussianSelection:
+    """ Gaussian selection: only the likely states are evaluated per frame
+
+    The state means are clustered into a small codebook (k-means, in a space
+    scaled by the average standard deviation). Each codeword keeps a
+    shortlist of the states with the highest density at the codeword. At run
+    time every frame is mapped to its nearest codeword and only the states
+    in that shortlist are evaluated exactly, the others get a floor value.
+    Mapping the frames to the codebook has a cost of its own, so this only
+    pays off for large banks: with the 61 states of the lab phone models,
+    evaluating every state is faster.
+
+    Example:
+       selection = GaussianSelection(GaussianBank(means, covars), means, covars)
+       obsloglik = selection.loglik(lmfcc)
+    """
+
+    def __init__(self, bank, means, covars, codewords=16, shortlist=32, floor=None):
+        """
+        Args:
+           bank: GaussianBank of the states
+           means, covars: SxD arrays the bank was built from
+           codewords: size of the codebook
+           shortlist: number of states evaluated for each codeword
+           floor: log likelihood given to the states that are not evaluated,
+                  by default the lowest evaluated value of the same frame
+        """
+        from scipy.cluster.vq import kmeans2
+        self.bank = bank
+        self.floor = floor
+        self.scale = np.sqrt(np.mean(covars, axis=0))
+        codebook, labels = kmeans2(means / self.scale, min(codewords, len(means)), minit='++', seed=0)
+        # k-means can leave empty clusters, only keep the used codewords
+        self.codebook = codebook[np.unique(labels)]
+        scores = bank.loglik(self.codebook * self.scale)
+        self.shortlists = np.argsort(-scores, axis=1)[:, :min(shortlist, len(means))]
+        # fraction of the state densities evaluated per frame
+        self.evaluated = self.shortlists.shape[1] / len(means)
+
+    def loglik(self, X):
+        """ Approximate log densities of the feature vectors
+
+        Args:
+           X: NxD array of feature vectors
+
+        Output:
+           NxS array of log likelihoods, exact for the shortlisted states
+        """
+        from scipy.cluster.vq import vq
+        codes = vq(X / self.scale, self.codebook)[0]
+        values = np.empty((len(X), self.shortlists.shape[1]), dtype=self.bank.dtype)
+        for code in np.unique(codes):
+            frames = np.flatnonzero(codes == code)
+            values[frames] = self.bank.loglik(X[frames], self.shortlists[code])
+        obsloglik = np.empty((len(X), len(self.bank.const)), dtype=self.bank.dtype)
+        obsloglik[:] = np.min(values, axis=1, keepdims=True) if self.floor is None else self.floor
+        obsloglik[np.arange(len(X))[:, None], self.shortlists[codes]] = values
+        return obsloglik
+
+
+class EmissionCache:
+    """ Emission log likelihoods for every state in a set of phone models
+
+    Word models built with concatHMMs reuse the states of the phone models,
+    so instead of evaluating the Gaussian densities once per word model,
+    the densities of all phone states are evaluated once per utterance and
+    each word model gathers its columns by index.
+
+    Example:
+       cache = EmissionCache(phoneHMMs)
+       cache.update(lmfcc)
+       loglik = cache.loglik(['sil', 'ow', 'sil'])
+    """
+
+    def __init__(self, phoneHMMs, dtype=np.float64, selection=None):
+        """
+        Args:
+           phoneHMMs: dictionary of phonetic Gaussian HMM models
+           dtype: float type of the density computations, see GaussianBank
+           selection: if given, a dictionary of GaussianSelection arguments
+                      (codewords, shortlist, floor); update then evaluates
+                      only the shortlisted states of each frame
+        """
+        self.stateList, self.means, self.covars = phoneStateBank(phoneHMMs)
+        self.bank = GaussianBank(self.means, self.covars, dtype)
+        self.selection = None
+        if selection is not None:
+            self.selection = GaussianSelection(self.bank, self.means, self.covars, **selection)
+        phones = sorted(phoneHMMs.keys())
+        self.nstates = {ph: phoneHMMs[ph]['means'].shape[0] for ph in phones}
+        offsets = np.cumsum([0] + [self.nstates[ph] for ph in phones])
+        self.offset = dict(zip(phones, offsets[:-1]))
+        self.obsloglik = None
+        self._indices = {}
+
+    def indices(self, namelist):
+        """ Bank indices of the states of concatHMMs(phoneHMMs, namelist)
+
+        Args:
+           namelist: list of phone names in the concatenated model
+
+        Output:
+           array of integer state indices into the bank, one per state
+        """
+        key = tuple(namelist)
+        if key not in self._indices:
+            self._indices[key] = np.concatenate(
+                [self.offset[ph] + np.arange(self.nstates[ph]) for ph in namelist])
+        return self._indices[key]
+
+    def update(self, X):
+        """ Evaluates all the phone states for a new utterance
+
+        Args:
+           X: NxD array of feature vectors
+
+        Output:
+           obsloglik: NxS array of log likelihoods for all S states in the bank
+        """
+        if self.selection is not None:
+            self.obsloglik = self.selection.loglik(X)
+        else:
+            self.obsloglik = self.bank.loglik(X)
+        return self.obsloglik
+
+    def loglik(self, namelist, X=None):
+        """ Emission log likelihoods for a concatenated model
+
+        Args:
+           namelist: list of phone names in the concatenated model
+           X: if given, only the states of the model are evaluated on these
+              feature vectors, instead of reading them from the last update
+
+        Output:
+           NxM array of log likelihoods, the same as calling
+           log_multivariate_normal_density_diag on the concatenated model
+        """
+        if X is not None:
+            return self.bank.loglik(X, self.indices(namelist))
+        return self.obsloglik[:, self.indices(namelist)]
@@ -0,0 +1,41 @@
+import numpy as np
+import lab2.proto2 as proto2
+import lab2.batch as batch
+from lab2.emissions import EmissionCache
+from lab2.prondict import prondict
+from timeit import default_timer as timer
+
+# Accuracy and speed of the digit classification with Gaussian selection,
+# compared to evaluating every state density
+
+#Load Data
+data = np.load('lab2_data.npz')['data']
+phoneHMMs = np.load('lab2_models.npz')['phoneHMMs'].item()
+
+# (codewords, shortlist) settings to compare
+settings = [(8, 48), (16, 32), (16, 16), (32, 16), (32, 8)]
+
+namelists = [['sil'] + prondict[digit] + ['sil'] for digit in prondict.keys()]
+log_startprob, log_trans = batch.padModels([proto2.concatHMMs(phoneHMMs, names) for names in namelists])
+utterances, lengths = batch.padUtterances([utterance['lmfcc'] for utterance in data])
+digits = list(prondict.keys())
+truth = np.array([digits.index(utterance['digit']) for utterance in data])
+
+
+def classify(emissions):
+    start = timer()
+    emissions.update(utterances.reshape(-1, utterances.shape[2]))
+    emissionTime = timer() - start
+    log_emlik = batch.batchLoglik(emissions, utterances, namelists)
+    loglik = batch.batchForward(log_emlik, lengths, log_startprob, log_trans)
+    return np.argmax(loglik, axis=1), emissionTime
+
+
+full, fullTime = classify(EmissionCache(phoneHMMs))
+print('all states: accuracy %.3f, emissions %.3f s' % (np.mean(full == truth), fullTime))
+for codewords, shortlist in settings:
+    emissions = EmissionCache(phoneHMMs, selection={'codewords': codewords, 'shortlist': shortlist})
+    result, time = classify(emissions)
+    print('%d codewords, %d states (%.0f%%): accuracy %.3f, agreement %.3f, emissions %.3f s'
+          % (codewords, shortlist, 100 * emissions.selection.evaluated, np.mean(result == truth),
+             np.mean(result == full), time))
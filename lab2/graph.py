@@ -0,0 +1,207 @@
+import numpy as np
+
+# Marks the exit of the graph in the entry lists of compileHMMs
+_EXIT = -1
+
+
+def compileHMMs(hmmmodels, namelist, loop=False):
+    """ Compiles a sequence of HMM models into a sparse graph
+
+    Same model as concatHMMs, but only the transitions with non zero
+    probability are kept, as a list of arcs. The models can have any number
+    of states and any feature dimension. A model whose startprob gives a
+    probability to the non emitting exit state (startprob[M] > 0, for example
+    a short pause 'sp' tee model) can be skipped: arcs are added from the
+    previous model straight into the following one.
+
+    Args:
+       hmmmodels: dictionary of HMM models (see concatHMMs)
+       namelist: list of model names that we want to concatenate
+       loop: if True, the arcs leaving the last model also go back into the
+             first one (log_exitprob keeps the probability of leaving the
+             graph, so the graph is not normalized, as in hmmLoop)
+
+    Output:
+       graph: see sparseGraph
+
+    Example:
+       graph = compileHMMs(phoneHMMs, ['sil', 'ow', 'sp', 'sil'])
+    """
+    nstates = [hmmmodels[name]['means'].shape[0] for name in namelist]
+    offsets = np.concatenate(([0], np.cumsum(nstates)))
+    S = offsets[-1]
+
+    # log probabilities of the states reached when entering each model
+    # (models that can be skipped also lead into the next ones)
+    entries = [{_EXIT: 0.0}]
+    with np.errstate(divide='ignore'):
+        for k in range(len(namelist) - 1, -1, -1):
+            m = nstates[k]
+            startprob = np.ravel(hmmmodels[namelist[k]]['startprob'])
+            entry = {offsets[k] + j: np.log(startprob[j]) for j in np.nonzero(startprob[:m])[0]}
+            if len(startprob) > m and startprob[m] > 0:
+                for state, logp in entries[0].items():
+                    entry[state] = np.logaddexp(entry.get(state, -np.inf), np.log(startprob[m]) + logp)
+            entries.insert(0, entry)
+    first = {state: logp for state, logp in entries[0].items() if state != _EXIT}
+
+    src, dst, logp = [], [], []
+    log_exitprob = np.full(S, -np.inf)
+    with np.errstate(divide='ignore'):
+        for k, name in enumerate(namelist):
+            m = nstates[k]
+            transmat = hmmmodels[name]['transmat']
+            i, j = np.nonzero(transmat[:m, :m])
+            src.append(offsets[k] + i)
+            dst.append(offsets[k] + j)
+            logp.append(np.log(transmat[i, j]))
+            for i in np.nonzero(transmat[:m, m])[0]:
+                exit = np.log(transmat[i, m])
+                targets = dict(entries[k + 1])
+                if _EXIT in targets:
+                    log_exitprob[offsets[k] + i] = exit + targets.pop(_EXIT)
+                    if loop:
+                        targets.update({s: l + log_exitprob[offsets[k] + i] - exit for s, l in first.items()})
+                src.append(np.full(len(targets), offsets[k] + i))
+                dst.append(np.array(list(targets.keys()), dtype=int))
+                logp.append(exit + np.array(list(targets.values())))
+
+    log_startprob = np.full(S, -np.inf)
+    log_startprob[list(first.keys())] = list(first.values())
+    stateList = [name + '_' + str(i) for name, m in zip(namelist, nstates) for i in range(m)]
+    return sparseGraph(np.concatenate(src), np.concatenate(dst), np.concatenate(logp), log_startprob,
+                       log_exitprob, np.vstack([hmmmodels[name]['means'] for name in namelist]),
+                       np.vstack([hmmmodels[name]['covars'] for name in namelist]), stateList)
+
+
+def sparseHMM(hmm):
+    """ Sparse graph of a model with a dense transition matrix
+
+    Args:
+       hmm: dictionary with the keys startprob, transmat, means and covars,
+            for example from concatHMMs or hmmLoop
+
+    Output:
+       graph: see sparseGraph
+    """
+    S = hmm['means'].shape[0]
+    transmat = hmm['transmat']
+    src, dst = np.nonzero(transmat[:S, :S])
+    with np.errstate(divide='ignore'):
+        return sparseGraph(src, dst, np.log(transmat[src, dst]), np.log(np.ravel(hmm['startprob'])[:S]),
+                           np.log(transmat[:S, S]), hmm['means'], hmm['covars'])
+
+
+def sparseGraph(src, dst, logp, log_startprob, log_exitprob, means, covars, stateList=None):
+    """ Builds the arc lists of a sparse HMM graph
+
+    Args:
+       src, dst, logp: arrays with the source state, destination state and
+                       log probability of each arc between emitting states
+       log_startprob: S array of log start probabilities
+       log_exitprob: S array of log probabilities of leaving the graph
+       means, covars: SxD arrays of the Gaussian emissions of the states
+       stateList: optional list of state names
+
+    Output:
+       graph: dictionary with the keys
+           log_startprob, log_exitprob, means, covars, stateList: as given
+           src, dst, logp: the arcs sorted by destination (and by source
+                           for the same destination)
+           inTargets, inStarts: states with incoming arcs and the index of
+                                their first arc, for np.ufunc.reduceat
+           outOrder: permutation of the arcs sorting them by source
+           outSources, outStarts: states with outgoing arcs and the index of
+                                  their first arc in outOrder
+    """
+    order = np.lexsort((src, dst))
+    src, dst, logp = src[order], dst[order], logp[order]
+    inTargets, inStarts = np.unique(dst, return_index=True)
+    outOrder = np.lexsort((dst, src))
+    outSources, outStarts = np.unique(src[outOrder], return_index=True)
+    return {'src': src, 'dst': dst, 'logp': logp,
+            'inTargets': inTargets, 'inStarts': inStarts,
+            'outOrder': outOrder, 'outSources': outSources, 'outStarts': outStarts,
+            'log_startprob': log_startprob, 'log_exitprob': log_exitprob,
+            'means': means, 'covars': covars, 'stateList': stateList}
+
+
+def graphForward(log_emlik, graph):
+    """Forward (alpha) probabilities in log domain over the arcs of a graph.
+
+    Args:
+        log_emlik: NxS array of emission log likelihoods, N frames, S states
+        graph: sparse graph, see sparseGraph
+
+    Output:
+        forward_prob: NxS array of forward log probabilities, the same as
+                      forward on the dense model
+    """
+    src, logp = graph['src'], graph['logp']
+    targets, starts = graph['inTargets'], graph['inStarts']
+    alpha = np.full(log_emlik.shape, -np.inf)
+    alpha[0] = graph['log_startprob'] + log_emlik[0]
+    for t in range(1, len(log_emlik)):
+        alpha[t, targets] = np.logaddexp.reduceat(alpha[t - 1, src] + logp, starts)
+        alpha[t] += log_emlik[t]
+    return alpha
+
+
+def graphBackward(log_emlik, graph):
+    """Backward (beta) probabilities in log domain over the arcs of a graph.
+
+    Args:
+        log_emlik: NxS array of emission log likelihoods, N frames, S states
+        graph: sparse graph, see sparseGraph
+
+    Output:
+        backward_prob: NxS array of backward log probabilities, the same as
+                       backward on the dense model
+    """
+    order = graph['outOrder']
+    dst, logp = graph['dst'][order], graph['logp'][order]
+    sources, starts = graph['outSources'], graph['outStarts']
+    beta = np.full(log_emlik.shape, -np.inf)
+    beta[-1] = 0.0
+    for t in range(len(log_emlik) - 2, -1, -1):
+        beta[t, sources] = np.logaddexp.reduceat((log_emlik[t + 1] + beta[t + 1])[dst] + logp, starts)
+    return beta
+
+
+def graphViterbi(log_emlik, graph, final=False):
+    """Viterbi path over the arcs of a graph.
+
+    Args:
+        log_emlik: NxS array of emission log likelihoods, N frames, S states
+        graph: sparse graph, see sparseGraph
+        final: if True, the path has to leave the graph after the last frame
+               (log_exitprob is added to the last scores), otherwise it can
+               end in any state as in viterbi
+
+    Output:
+        viterbi_loglik: log likelihood of the best path
+        viterbi_path: best path
+    """
+    observations, states = log_emlik.shape
+    src, dst, logp = graph['src'], graph['dst'], graph['logp']
+    targets, starts = graph['inTargets'], graph['inStarts']
+    B = np.zeros((observations - 1, states), dtype=np.min_scalar_type(states - 1))
+    arcs = np.arange(len(src))
+    delta = graph['log_startprob'] + log_emlik[0]
+    for t in range(1, observations):
+        scores = delta[src] + logp
+        delta = np.full(states, -np.inf)
+        delta[targets] = np.maximum.reduceat(scores, starts)
+        # the first (lowest source) arc reaching the best score of its state
+        first = np.minimum.reduceat(np.where(scores == delta[dst], arcs, len(arcs)), starts)
+        B[t - 1, targets] = src[np.minimum(first, len(arcs) - 1)]
+        delta += log_emlik[t]
+    if final:
+        delta = delta + graph['log_exitprob']
+    state = np.argmax(delta)
+    loglik = delta[state]
+    path = np.zeros(observations, dtype=np.intp)
+    path[-1] = state
+    for t in range(observations - 2, -1, -1):
+        path[t] = B[t, path[t + 1]]
+    return loglik, path
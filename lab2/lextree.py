@@ -0,0 +1,140 @@
+import numpy as np
+from lab2.tools2 import logsumexp
+from lab2.emissions import EmissionCache
+
+
+def lexicalTree(phoneHMMs, pronDict, addSilence=True, addShortPause=False):
+    """ Merges the word models of a pronunciation dictionary into a prefix tree
+
+    The word models are the ones built by concatHMMs on
+    words2phones([word], pronDict, addSilence, addShortPause), that is
+    ['sil'] + pronunciation + ['sil'] by default, with 'sp' before the last
+    silence when addShortPause is True. The leading silence and the
+    pronunciation prefixes that the words have in common are shared, so
+    their states are scored once for all the words. The trailing short pause
+    and silence are kept separate for each word, so that every word keeps
+    its own score.
+
+    The exit probabilities of a phone are not divided among its children:
+    every branch gets the same transitions as in the word model, so the
+    scores of each word are exactly those of its concatenated model.
+
+    Args:
+       phoneHMMs: dictionary of phonetic Gaussian HMM models
+       pronDict: dictionary of pronunciations, word -> list of phones
+       addSilence, addShortPause: as in words2phones
+
+    Output:
+       tree: dictionary with the keys
+           words: list of W words, in the order of pronDict
+           phones: list of phone names, one per tree node
+           parents: array with the parent node of each node (-1 at the root)
+           states: array of S bank indices (see EmissionCache), one per state
+           log_startprob: S array of log start probabilities
+           arcs: (src, dst, logp) arrays of transitions between states,
+                 sorted by destination
+           targets, starts: the states with incoming arcs and the index of
+                            their first arc, for np.ufunc.reduceat
+           wordStates: list of W arrays with the states on the path of each
+                       word from the root to its leaf
+    """
+    emissions = EmissionCache(phoneHMMs)
+    words = list(pronDict.keys())
+    phones = []
+    parents = []
+    children = {}
+
+    def addNode(phone, parent, shared=True):
+        if shared and (parent, phone) in children:
+            return children[(parent, phone)]
+        phones.append(phone)
+        parents.append(parent)
+        if shared:
+            children[(parent, phone)] = len(phones) - 1
+        return len(phones) - 1
+
+    root = addNode('sil', -1) if addSilence else -1
+    tail = (['sp'] if addShortPause else []) + (['sil'] if addSilence else [])
+    wordNodes = []
+    for word in words:
+        node = root
+        path = [root] if addSilence else []
+        for phone in pronDict[word]:
+            node = addNode(phone, node)
+            path.append(node)
+        for phone in tail:
+            node = addNode(phone, node, shared=False)
+            path.append(node)
+        wordNodes.append(path)
+
+    nstates = np.array([emissions.nstates[phone] for phone in phones])
+    offsets = np.concatenate(([0], np.cumsum(nstates)))
+    S = offsets[-1]
+    src, dst, logp = [], [], []
+    with np.errstate(divide='ignore'):
+        for node, phone in enumerate(phones):
+            m = nstates[node]
+            transmat = phoneHMMs[phone]['transmat']
+            i, j = np.nonzero(transmat[:m, :m])
+            src.append(offsets[node] + i)
+            dst.append(offsets[node] + j)
+            logp.append(np.log(transmat[i, j]))
+            parent = parents[node]
+            if parent >= 0:
+                # the exit of the parent goes into the first state of the child
+                pm = nstates[parent]
+                ptransmat = phoneHMMs[phones[parent]]['transmat']
+                i = np.nonzero(ptransmat[:pm, pm])[0]
+                src.append(offsets[parent] + i)
+                dst.append(np.full(len(i), offsets[node]))
+                logp.append(np.log(ptransmat[i, pm]))
+    src, dst, logp = np.concatenate(src), np.concatenate(dst), np.concatenate(logp)
+    order = np.argsort(dst, kind='stable')
+    src, dst, logp = src[order], dst[order], logp[order]
+    targets, starts = np.unique(dst, return_index=True)
+
+    # the roots start as their phone model does (as in compileHMMs)
+    log_startprob = np.full(S, -np.inf)
+    with np.errstate(divide='ignore'):
+        for node in np.flatnonzero(np.array(parents) == -1):
+            m = nstates[node]
+            log_startprob[offsets[node]:offsets[node] + m] = np.log(np.ravel(phoneHMMs[phones[node]]['startprob'])[:m])
+    return {'words': words,
+            'phones': phones,
+            'parents': np.array(parents),
+            'states': np.concatenate([emissions.indices([phone]) for phone in phones]),
+            'log_startprob': log_startprob,
+            'arcs': (src, dst, logp),
+            'targets': targets,
+            'starts': starts,
+            'wordStates': [np.concatenate([np.arange(offsets[n], offsets[n + 1]) for n in path])
+                           for path in wordNodes]}
+
+
+def treeScores(tree, obsloglik, viterbi=False):
+    """ Scores all the words in a lexical tree in one pass
+
+    Args:
+       tree: lexical tree, see lexicalTree
+       obsloglik: NxS array of emission log likelihoods for all the states in
+                  the phone bank (see EmissionCache.update)
+       viterbi: if True, score with the best path instead of the forward
+                probabilities
+
+    Output:
+       W array with the log likelihood of the utterance given each word
+       model, the same as forward (or viterbi) on the concatenated models
+    """
+    log_emlik = obsloglik[:, tree['states']]
+    src, dst, logp = tree['arcs']
+    targets, starts = tree['targets'], tree['starts']
+    reduce = np.maximum if viterbi else np.logaddexp
+    score = tree['log_startprob'] + log_emlik[0]
+    for frame in log_emlik[1:]:
+        new = np.full(len(score), -np.inf)
+        with np.errstate(invalid='ignore'):
+            new[targets] = reduce.reduceat(score[src] + logp, starts)
+        score = new + frame
+    if viterbi:
+        return np.array([np.max(score[states]) for states in tree['wordStates']])
+    return np.array([logsumexp(score[states]) for states in tree['wordStates']])
@@ -1,8 +1,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import lab2.proto2 as proto2
-import lab2.tools2 as tools2
 import lab2.plotting as plotting
+import lab2.batch as batch
+from lab2.emissions import EmissionCache, GaussianBank
 from lab2.prondict import prondict
 from timeit import default_timer as timer
 
@@ -36,7 +37,7 @@ log_trans = np.log(hmmTest['transmat'])[:-1, :-1]
 #Temporary testing
 #proto2.baum_welch(lmfcc_example, hmmTest['means'], hmmTest['covars'], log_startprob, log_trans, example_data)
 
-loglikelihood = tools2.log_multivariate_normal_density_diag(lmfcc_example, hmmTest['means'], hmmTest['covars'])
+loglikelihood = GaussianBank(hmmTest['means'], hmmTest['covars']).loglik(lmfcc_example)
 
 #Forward alogithm
 log_alpha = proto2.forward(loglikelihood, log_startprob ,log_trans)
@@ -111,25 +112,20 @@ plt.pcolormesh(np.transpose(Prob6Fb))
 '''
 
 #Get best scores for all utterances
-viterbiTable = np.zeros((44,11))
 #modellistKeys = list(modellist.keys())
 modellistKeys = ['o','z', '1', '2', '3', '4', '5', '6', '7', '8', '9']
 xlabels = []
 pred = []
 ground_truth = []
+#Score all utterances against all word models in one batch
+namelists = [modellist[key] for key in modellistKeys]
+utterances, lengths = batch.padUtterances([data[i]['lmfcc'] for i in range(0,44)])
+log_emlik = batch.batchLoglik(EmissionCache(phoneHMMs), utterances, namelists)
+log_startprob, log_trans = batch.padModels([proto2.concatHMMs(phoneHMMs, names) for names in namelists])
+viterbiTable = batch.batchViterbi(log_emlik, lengths, log_startprob, log_trans)
 for i in range(0,44):
-    lmfcc = data[i]['lmfcc']
     #normalize = len(data[0]['lmfcc'])
     xlabels.append(data[i]['digit'] + data[i]['gender'] + data[i]['repetition'])
-    print(str(i))
-    for j in range(0,11):
-        hmm = proto2.concatHMMs(phoneHMMs, modellist[modellistKeys[j]])
-        loglikelihood = tools2.log_multivariate_normal_density_diag(lmfcc, hmm['means'], hmm['covars'])
-        log_startprob = np.log(hmm['startprob'])
-        log_trans = np.log(hmm['transmat'])[:-1, :-1]
-        viter = proto2.viterbi(loglikelihood, log_startprob ,log_trans)
-        viterbiTable[i,j] = viter[0]
-
     pred.append(np.argmax(viterbiTable[i,:]))
     # Getting true result
     digit = data[i]['digit']
@@ -1,7 +1,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import lab2.proto2 as proto2
-import lab2.tools2 as tools2
+import lab2.batch as batch
+from lab2.emissions import EmissionCache
+from lab2.online import earlyStopClassify
 from lab2.prondict import prondict
 from timeit import default_timer as timer
 
@@ -9,12 +11,31 @@ from timeit import default_timer as timer
 data = np.load('lab2_data.npz')['data']
 phoneHMMs = np.load('lab2_models.npz')['phoneHMMs'].item()
 
+# Drop a word model once it is this far (in log likelihood) behind the best one,
+# np.inf scores every model to the end (exact classification)
+MARGIN = np.inf
+
 # Create modellist from prondict
 modellist = {}
 for digit in prondict.keys():
     modellist[digit] = ['sil'] + prondict[digit] + ['sil']
 
-loglik = np.zeros((len(data),len(modellist)))
+# Forward scores of every utterance given every word model, in one batch
+namelists = [modellist[modelkey] for modelkey in modellist.keys()]
+utterances, lengths = batch.padUtterances([utterance['lmfcc'] for utterance in data])
+log_emlik = batch.batchLoglik(EmissionCache(phoneHMMs), utterances, namelists)
+log_startprob, log_trans = batch.padModels([proto2.concatHMMs(phoneHMMs, names) for names in namelists])
+if np.isinf(MARGIN):
+    loglik = batch.batchForward(log_emlik, lengths, log_startprob, log_trans)
+else:
+    # Advance all the models together and stop scoring the ones that fall behind
+    loglik = np.zeros((len(data), len(modellist)))
+    scored = 0
+    for i in range(len(data)):
+        best, loglik[i], frames = earlyStopClassify(log_emlik[i, :, :lengths[i]], log_startprob, log_trans, MARGIN)
+        scored += np.sum(frames)
+    print('scored', scored, 'of', np.sum(lengths) * len(modellist), 'model frames')
+
 ground_truth = []
 classification = []
 for i, utterance in enumerate(data):
@@ -27,20 +48,6 @@ for i, utterance in enumerate(data):
     else: truth = int(digit) + 1
     ground_truth.append(truth)
 
-    for j, modelkey in enumerate(modellist.keys()):
-        lmfcc = utterance['lmfcc']
-
-        #Generate HMM for the word zero
-        hmmTest = proto2.concatHMMs(phoneHMMs,modellist[modelkey])
-        log_startprob = np.log(hmmTest['startprob'])
-        log_trans = np.log(hmmTest['transmat'])[:-1, :-1]
-
-        loglikelihood = tools2.log_multivariate_normal_density_diag(lmfcc, hmmTest['means'], hmmTest['covars'])
-
-        #Forward alogithm
-        log_alpha = proto2.forward(loglikelihood, log_startprob ,log_trans)
-        loglik[i,j] = tools2.logsumexp(log_alpha[-1])
-
     classified = np.argmax(loglik[i,:])
     classification.append(classified)
 
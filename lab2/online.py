@@ -0,0 +1,177 @@
+import numpy as np
+from lab2.tools2 import logsumexp
+from lab2.proto2 import viterbiSegment, viterbiTraceback, pruneStates
+
+
+class OnlineForward:
+    """ Forward probabilities computed as the emissions arrive
+
+    Only the current alpha vector is kept, so memory does not grow with the
+    length of the input.
+
+    Example:
+       decoder = OnlineForward(log_startprob, log_transmat)
+       for chunk in chunks:
+           decoder.push(chunk)
+       loglik = decoder.loglik()
+    """
+
+    def __init__(self, log_startprob, log_transmat):
+        self.log_transmat = log_transmat
+        self.log_startprob = np.ravel(log_startprob)[:log_transmat.shape[0]]
+        self.alpha = None
+        self.frames = 0
+
+    def push(self, log_emlik):
+        """ Advances the forward recursion
+
+        Args:
+           log_emlik: M array with the emission log likelihoods of one frame,
+                      or LxM array for a chunk of L frames
+
+        Output:
+           alpha: M array of forward log probabilities at the last frame
+        """
+        for frame in np.atleast_2d(log_emlik):
+            if self.alpha is None:
+                self.alpha = self.log_startprob + frame
+            else:
+                self.alpha = logsumexp(self.alpha[:, None] + self.log_transmat, axis=0) + frame
+            self.frames += 1
+        return self.alpha
+
+    def loglik(self):
+        """ Log likelihood of the frames pushed so far """
+        return logsumexp(self.alpha)
+
+
+class OnlineViterbi:
+    """ Viterbi decoding with partial traceback as the emissions arrive
+
+    Only the current delta vector and the backpointers of the frames that
+    are not decided yet are kept. After each push, all the active hypotheses
+    are traced back: once they go through a single state, the best path up
+    to that frame can no longer change and it is emitted. Without a beam,
+    every reachable state stays active and little is emitted before the
+    end; with a beam the delay is typically a few frames.
+
+    Example:
+       decoder = OnlineViterbi(log_startprob, log_transmat)
+       path = []
+       for chunk in chunks:
+           path += list(decoder.push(chunk))
+       path += list(decoder.finish())
+    """
+
+    def __init__(self, log_startprob, log_transmat, beam=None, max_active=None):
+        self.log_transmat = log_transmat
+        self.log_startprob = np.ravel(log_startprob)[:log_transmat.shape[0]]
+        self.beam = beam
+        self.max_active = max_active
+        self.dtype = np.min_scalar_type(log_transmat.shape[0] - 1)
+        self.delta = None
+        self.B = []
+        self.frames = 0
+        self.committed = 0
+
+    def push(self, log_emlik):
+        """ Advances the Viterbi recursion
+
+        Args:
+           log_emlik: M array with the emission log likelihoods of one frame,
+                      or LxM array for a chunk of L frames
+
+        Output:
+           array with the states of the best path for the frames that became
+           stable, starting at the first frame not returned before
+        """
+        for frame in np.atleast_2d(log_emlik):
+            if self.delta is None:
+                self.delta = self.log_startprob + frame
+            else:
+                self.delta, B = viterbiSegment(self.delta, frame[None], self.log_transmat, self.dtype,
+                                               self.beam, self.max_active)
+                if self.frames > self.committed:
+                    # only keep backpointers into frames not returned yet
+                    self.B.append(B[0])
+            self.frames += 1
+        return self.partialTraceback()
+
+    def partialTraceback(self):
+        """ Emits the part of the best path shared by all active hypotheses """
+        if self.committed == self.frames:
+            return np.zeros(0, dtype=np.intp)
+        states = pruneStates(self.delta, self.beam, self.max_active)
+        k = len(self.B)
+        while len(states) > 1 and k > 0:
+            k -= 1
+            states = np.unique(self.B[k][states])
+        if len(states) != 1:
+            return np.zeros(0, dtype=np.intp)
+        # the frames up to self.committed + k are decided
+        path = viterbiTraceback(np.array(self.B[:k], dtype=self.dtype).reshape(k, len(self.delta)), states[0])
+        self.B = self.B[k + 1:]
+        self.committed += k + 1
+        return path
+
+    def finish(self):
+        """ Ends the utterance
+
+        Output:
+           array with the best path for the frames that were not returned yet
+        """
+        if self.committed == self.frames:
+            return np.zeros(0, dtype=np.intp)
+        state = np.argmax(self.delta)
+        k = len(self.B)
+        path = viterbiTraceback(np.array(self.B, dtype=self.dtype).reshape(k, len(self.delta)), state)
+        self.B = []
+        self.committed = self.frames
+        return path
+
+    def loglik(self):
+        """ Log likelihood of the best path for the frames pushed so far """
+        return np.max(self.delta)
+
+
+def earlyStopClassify(log_emlik, log_startprob, log_transmat, margin=np.inf):
+    """ Classification that drops competing models as soon as they fall behind
+
+    All the models are advanced frame by frame with the forward recursion.
+    After each frame, the models whose best partial score (max of alpha) is
+    more than margin below the leader's are dropped, and the classification
+    ends as soon as a single model is left. With margin=np.inf no model is
+    dropped and the result is the argmax of the full forward log likelihoods.
+
+    Args:
+       log_emlik: WxNxM array of emission log likelihoods of one utterance
+                  for W models with (padded) M states, see lab2.batch
+       log_startprob: WxM array of log start probabilities, see padModels
+       log_transmat: WxMxM array of log transition probabilities
+       margin: log score margin behind the leader before a model is dropped
+
+    Output:
+       best: index of the winning model
+       loglik: W array with the forward log likelihood of each model up to
+               the frame where it was dropped (or the classification ended)
+       frames: W array with the number of frames scored for each model
+    """
+    W, N, M = log_emlik.shape
+    alpha = log_startprob + log_emlik[:, 0]
+    active = np.arange(W)
+    frames = np.full(W, N)
+    loglik = logsumexp(alpha, axis=1)
+    for t in range(1, N):
+        new = logsumexp(alpha[active, :, None] + log_transmat[active], axis=1) + log_emlik[active, t]
+        alpha[active] = new
+        best = np.max(new, axis=1)
+        behind = best < np.max(best) - margin
+        if np.any(behind):
+            loglik[active[behind]] = logsumexp(new[behind], axis=1)
+            frames[active[behind]] = t + 1
+            active = active[~behind]
+        if len(active) == 1:
+            frames[active] = t + 1
+            break
+    loglik[active] = logsumexp(alpha[active], axis=1)
+    return active[np.argmax(loglik[active])], loglik, frames
@@ -0,0 +1,119 @@
+import os
+import numpy as np
+
+# Arrays of a phone bank directory, one .npy file each
+_ARRAYS = ['phones', 'offsets', 'means', 'covars', 'startprob', 'transmat', 'transOffsets']
+
+
+def savePhoneBank(dirname, phoneHMMs):
+    """ Saves phone models as a directory of flat arrays
+
+    Args:
+       dirname: directory to write, created if needed
+       phoneHMMs: dictionary of phonetic Gaussian HMM models, as in
+                  lab2_models.npz
+
+    The directory has one .npy file per array (see PhoneBank), which can be
+    memory mapped instead of unpickling the dictionary.
+    """
+    phones = sorted(phoneHMMs.keys())
+    nstates = [phoneHMMs[ph]['means'].shape[0] for ph in phones]
+    arrays = {'phones': np.array(phones),
+              'offsets': np.cumsum([0] + nstates),
+              'means': np.vstack([phoneHMMs[ph]['means'] for ph in phones]),
+              'covars': np.vstack([phoneHMMs[ph]['covars'] for ph in phones]),
+              'startprob': np.concatenate([np.ravel(phoneHMMs[ph]['startprob']) for ph in phones]),
+              'transmat': np.concatenate([np.ravel(phoneHMMs[ph]['transmat']) for ph in phones]),
+              'transOffsets': np.cumsum([0] + [(m + 1)**2 for m in nstates])}
+    os.makedirs(dirname, exist_ok=True)
+    for name in _ARRAYS:
+        np.save(os.path.join(dirname, name + '.npy'), arrays[name])
+
+
+def loadPhoneBank(dirname, modelsfile, mmap_mode='r'):
+    """ Opens the phone bank of a models file, rebuilding it when needed
+
+    The bank is a cache of modelsfile: it is written again (see
+    savePhoneBank) when the directory is missing, incomplete or older than
+    modelsfile, for example after retraining.
+
+    Args:
+       dirname: directory of the phone bank
+       modelsfile: npz file of the phone models, as in lab2_models.npz
+       mmap_mode: see PhoneBank
+
+    Output:
+       PhoneBank of the models in modelsfile
+    """
+    files = [os.path.join(dirname, name + '.npy') for name in _ARRAYS]
+    if not all(os.path.exists(file) for file in files) or \
+            min(os.path.getmtime(file) for file in files) < os.path.getmtime(modelsfile):
+        savePhoneBank(dirname, np.load(modelsfile, allow_pickle=True)['phoneHMMs'].item())
+    return PhoneBank(dirname, mmap_mode)
+
+
+class PhoneBank:
+    """ Phone models stored as flat arrays with integer state IDs
+
+    The states of all the phones are stacked in the same order as
+    phoneStateBank (phones sorted by name), so a state ID is a row of means
+    and covars, and a column of EmissionCache.obsloglik.
+
+    Attributes:
+       phones: P array of phone names, sorted
+       index: dictionary phone name -> phone index
+       stateList: list of S state names in the form phone_index
+       offsets: P+1 array, the states of phone p are offsets[p]:offsets[p+1]
+       means, covars: SxD arrays of the Gaussian emissions of all the states
+       startprob: flat array with the M+1 start probabilities of each phone
+                  (phone p starts at offsets[p] + p)
+       transmat: flat array with the (M+1)x(M+1) transition matrix of each
+                 phone, phone p starts at transOffsets[p]
+
+    Example:
+       savePhoneBank('phonebank', phoneHMMs)
+       bank = PhoneBank('phonebank')
+       bank = loadPhoneBank('phonebank', 'lab2_models.npz')  # kept up to date
+       ids = bank.stateIds(['sil', 'ow', 'sil'])
+    """
+
+    def __init__(self, dirname, mmap_mode='r'):
+        """
+        Args:
+           dirname: directory written by savePhoneBank
+           mmap_mode: passed to np.load, None to read the arrays in memory
+        """
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(dirname, name + '.npy'), mmap_mode=mmap_mode))
+        self.index = {phone: p for p, phone in enumerate(self.phones.tolist())}
+        self.nstates = np.diff(self.offsets)
+        self.stateList = [phone + '_' + str(i) for phone, m in zip(self.phones.tolist(), self.nstates)
+                          for i in range(m)]
+        self._ids = {phone: np.arange(self.offsets[p], self.offsets[p + 1]) for phone, p in self.index.items()}
+
+    def stateIds(self, phoneTrans):
+        """ Integer state IDs of a sequence of phones
+
+        Args:
+           phoneTrans: list of phone names
+
+        Output:
+           array with the IDs of the states of concatHMMs(phoneHMMs, phoneTrans),
+           the same as stateList.index for each phone_index state name
+        """
+        return np.concatenate([self._ids[phone] for phone in phoneTrans])
+
+    def hmm(self, phone):
+        """ Model of one phone in the lab2_models.npz format, as views of the arrays """
+        p = self.index[phone]
+        m = self.nstates[p]
+        start, end = self.offsets[p], self.offsets[p + 1]
+        return {'name': phone,
+                'startprob': self.startprob[start + p:end + p + 1],
+                'transmat': self.transmat[self.transOffsets[p]:self.transOffsets[p + 1]].reshape(m + 1, m + 1),
+                'means': self.means[start:end],
+                'covars': self.covars[start:end]}
+
+    def hmms(self):
+        """ Dictionary of all the phone models, as in lab2_models.npz """
+        return {phone: self.hmm(phone) for phone in self.index}
@@ -1,6 +1,6 @@
 import numpy as np
 from lab2.tools2 import *
-from sklearn.mixture import gmm
+from lab2.emissions import GaussianBank
 import copy
 
 
@@ -26,18 +26,21 @@ def concatHMMs(hmmmodels, namelist):
     Example:
        wordHMMs['o'] = concatHMMs(phoneHMMs, ['sil', 'ow', 'sil'])
     """
-    wordHmm = dict2 = copy.deepcopy(hmmmodels[namelist[0]])
-    d = 4*len(namelist)-(len(namelist)-1)
-    wordHmm['transmat'] = np.zeros((d,d))
-    wordHmm['means'] = np.zeros((3*len(namelist),13))
-    wordHmm['covars'] = np.zeros((3*len(namelist), 13))
-    wordHmm['startprob'] = np.zeros((1, 3*len(namelist)))
+    wordHmm = copy.deepcopy(hmmmodels[namelist[0]])
+    nstates = [hmmmodels[name]['means'].shape[0] for name in namelist]
+    states = sum(nstates)
+    dim = hmmmodels[namelist[0]]['means'].shape[1]
+    wordHmm['transmat'] = np.zeros((states+1,states+1))
+    wordHmm['means'] = np.zeros((states,dim))
+    wordHmm['covars'] = np.zeros((states,dim))
+    wordHmm['startprob'] = np.zeros((1, states))
     wordHmm['startprob'][0,0] = 1
-    for i in range(0,len(namelist)):
-        c = i*3#c is the coordinate
-        wordHmm['transmat'][c:c+4, c:c+4] = hmmmodels[namelist[i]]['transmat']
-        wordHmm['means'][c:c+3,:] = hmmmodels[namelist[i]]['means']
-        wordHmm['covars'][c:c + 3, :] = hmmmodels[namelist[i]]['covars']
+    c = 0#c is the coordinate
+    for name, m in zip(namelist, nstates):
+        wordHmm['transmat'][c:c+m+1, c:c+m+1] = hmmmodels[name]['transmat']
+        wordHmm['means'][c:c+m,:] = hmmmodels[name]['means']
+        wordHmm['covars'][c:c+m,:] = hmmmodels[name]['covars']
+        c += m
     wordHmm['transmat'][-1, -1] = 1
     return wordHmm
 
@@ -60,16 +63,22 @@ def gmmloglik(log_emlik, weights):
     gmmloglik = np.log(likelihood)
     return gmmloglik
 
-def forward(log_emlik, log_startprob, log_transmat, ref=None):
+def forward(log_emlik, log_startprob, log_transmat, ref=None, beam=None, max_active=None):
     """Forward (alpha) probabilities in log domain.
 
     Args:
         log_emlik: NxM array of emission log likelihoods, N frames, M states
         log_startprob: log probability to start in state i
         log_transmat: log transition probability from state i to j
+        beam: if given, states whose alpha is more than beam below the best
+              state at the same frame are pruned (see pruneStates)
+        max_active: if given, at most max_active states are kept per frame
 
     Output:
-        forward_prob: NxM array of forward log probabilities for each of the M states in the model
+        forward_prob: NxM array of forward log probabilities for each of the M states in the model,
+                      -inf for pruned states
+        pruned: (only with beam or max_active) N-1 array with the number of
+                states pruned at each frame
     """
     observations = len(log_emlik)#Each row in log_emlik corresponds to one observation
     states = len(log_emlik[0])
@@ -78,11 +87,20 @@ def forward(log_emlik, log_startprob, log_transmat, ref=None):
     for j in range(0,states):
         alpha[0,j] = log_startprob[0,j] + log_emlik[0,j]
 
+    if beam is not None or max_active is not None:
+        #Only propagate the active states to the states they can reach
+        alpha[1:] = -np.inf
+        pruned = np.zeros(observations - 1, dtype=int)
+        for i in range(1,observations):
+            active = pruneStates(alpha[i-1], beam, max_active)
+            pruned[i-1] = np.count_nonzero(np.isfinite(alpha[i-1])) - len(active)
+            succ = np.flatnonzero(np.isfinite(log_transmat[active]).any(axis=0))
+            scores = alpha[i-1, active, None] + log_transmat[np.ix_(active, succ)]
+            alpha[i, succ] = logsumexp(scores, axis=0) + log_emlik[i, succ]
+        return alpha, pruned
+
     for i in range(1,observations):
-        a1 = np.zeros((states,states))
-        frame = np.zeros(states)
-        for j in range(0, states):
-            alpha[i,j] = logsumexp(alpha[i-1,:] + log_transmat[:,j]) + log_emlik[i,j]
+        alpha[i] = logsumexp(alpha[i-1,:,None] + log_transmat, axis=0) + log_emlik[i]
 
     return alpha
 
@@ -131,42 +149,282 @@ def backward(log_emlik, log_startprob, log_transmat):
     p_backward = np.flip(np.vstack(b_prob), axis=0)
     return p_backward
 
-def viterbi(log_emlik, log_startprob, log_transmat):
+def pruneStates(scores, beam=None, max_active=None):
+    """Beam pruning of the states at one frame.
+
+    Args:
+        scores: M array of log scores (alpha or delta) at the current frame
+        beam: keep the states whose score is within beam of the best one
+        max_active: keep at most this many states (the best ones)
+
+    Output:
+        array with the indices of the states that stay active
+    """
+    active = np.flatnonzero(np.isfinite(scores))
+    if beam is not None and len(active) > 0:
+        active = active[scores[active] >= np.max(scores[active]) - beam]
+    if max_active is not None and len(active) > max_active:
+        best = np.argpartition(-scores[active], max_active - 1)[:max_active]
+        active = np.sort(active[best])
+    return active
+
+
+def viterbi(log_emlik, log_startprob, log_transmat, checkpoint=False, beam=None, max_active=None):
     """Viterbi path.
 
     Args:
         log_emlik: NxM array of emission log likelihoods, N frames, M states
         log_startprob: log probability to start in state i
         log_transmat: transition log probability from state i to j
+        checkpoint: if True, only the scores at every sqrt(N)-th frame are
+                    kept during the forward pass and the backpointers of each
+                    segment are recomputed during traceback. Memory goes from
+                    O(N*M) to O(sqrt(N)*M) for about twice the computation
+        beam: if given, states whose score is more than beam below the best
+              state at the same frame are not propagated (see pruneStates)
+        max_active: if given, at most max_active states are propagated per frame
 
     Output:
         viterbi_loglik: log likelihood of the best path
         viterbi_path: best path
+        pruned: (only with beam or max_active) N-1 array with the number of
+                states pruned at each frame
     """
-    observations = len(log_emlik)  # Each row in log_emlik corresponds to one observation
-    states = len(log_emlik[0])
-    V = np.zeros((observations, states))
-    B = np.zeros((observations,states))
+    observations, states = log_emlik.shape
+    dtype = np.min_scalar_type(states - 1)
+    pruning = beam is not None or max_active is not None
+    pruned = [] if pruning else None
+
+    #Initialize the scores with the first frame
+    delta = np.ravel(log_startprob)[:states] + log_emlik[0, :]
+
+    if not checkpoint:
+        delta, B = viterbiSegment(delta, log_emlik[1:], log_transmat, dtype, beam, max_active, pruned)
+        state = np.argmax(delta)
+        if pruning:
+            return delta[state], viterbiTraceback(B, state), np.array(pruned, dtype=int)
+        return delta[state], viterbiTraceback(B, state)
+
+    #Propagate best paths forward, only storing the scores at the checkpoints
+    step = int(np.ceil(np.sqrt(observations)))
+    checkpoints = []
+    for start in range(0, observations - 1, step):
+        checkpoints.append(delta)
+        delta = viterbiSegment(delta, log_emlik[start + 1:start + step + 1], log_transmat,
+                               None, beam, max_active, pruned)
+
+    #Recompute the backpointers one segment at a time, from the end
+    state = np.argmax(delta)
+    lenOfShortest = delta[state]
+    bestPath = np.zeros(observations, dtype=np.intp)
+    bestPath[-1] = state
+    for c in range(len(checkpoints) - 1, -1, -1):
+        start = c * step
+        end = min(start + step, observations - 1)
+        B = viterbiSegment(checkpoints[c], log_emlik[start + 1:end + 1], log_transmat,
+                           dtype, beam, max_active)[1]
+        bestPath[start:end + 1] = viterbiTraceback(B, bestPath[end])
+    if pruning:
+        return lenOfShortest, bestPath, np.array(pruned, dtype=int)
+    return lenOfShortest, bestPath
+
+
+def viterbiSegment(delta, log_emlik, log_transmat, dtype=None, beam=None, max_active=None, pruned=None):
+    """Viterbi recursion over a segment of frames.
+
+    Args:
+        delta: M array with the best path scores at the frame before the segment
+        log_emlik: LxM array of emission log likelihoods for the L frames
+        log_transmat: transition log probability from state i to j
+        dtype: integer type for the backpointers, if None they are not stored
+        beam, max_active: beam pruning parameters (see pruneStates)
+        pruned: if a list is given, the number of pruned states at each
+                frame is appended to it
+
+    Output:
+        delta: M array with the best path scores at the last frame
+        B: (only if dtype is given) LxM array of backpointers
+    """
+    states = log_transmat.shape[1]
+    if dtype is not None:
+        B = np.zeros((len(log_emlik), states), dtype=dtype)
+    for o, frame in enumerate(log_emlik):
+        if beam is None and max_active is None:
+            scores = delta[:, None] + log_transmat
+            best = np.argmax(scores, axis=0)
+            delta = scores[best, np.arange(states)] + frame
+        else:
+            #Only propagate the active states to the states they can reach
+            active = pruneStates(delta, beam, max_active)
+            if pruned is not None:
+                pruned.append(np.count_nonzero(np.isfinite(delta)) - len(active))
+            succ = np.flatnonzero(np.isfinite(log_transmat[active]).any(axis=0))
+            scores = delta[active, None] + log_transmat[np.ix_(active, succ)]
+            local = np.argmax(scores, axis=0)
+            delta = np.full(states, -np.inf)
+            delta[succ] = scores[local, np.arange(len(succ))] + frame[succ]
+            best = np.zeros(states, dtype=np.intp)
+            best[succ] = active[local]
+        if dtype is not None:
+            B[o] = best
+    if dtype is None:
+        return delta
+    return delta, B
+
+
+def viterbiTraceback(B, state):
+    """Follows the backpointers of a segment from its last frame.
+
+    Args:
+        B: LxM array of backpointers, as returned by viterbiSegment
+        state: best state at the last frame of the segment
+
+    Output:
+        (L+1) array with the best path, starting at the frame before the segment
+    """
+    bestPath = np.zeros(len(B) + 1, dtype=np.intp)
+    bestPath[-1] = state
+    for o in range(len(B) - 1, -1, -1):
+        state = B[o, state]
+        bestPath[o] = state
+    return bestPath
+
+
+def transitionBand(log_transmat):
+    """Band representation of a transition matrix.
+
+    In a left to right model built by concatHMMs, every state can only be
+    reached from a few states just before or after it (the previous state,
+    itself, and the skip and backward arcs of models like sil). The band keeps
+    only these diagonals.
+
+    Args:
+        log_transmat: MxM array of log transition probabilities
+
+    Output:
+        offsets: K array with the offsets j - i of the non zero diagonals
+        log_band: KxM array, log_band[k, j] is the log probability of the
+                  transition from state j - offsets[k] to state j (-inf if it
+                  does not exist)
+    """
+    i, j = np.nonzero(np.isfinite(log_transmat))
+    offsets = np.unique(j - i)
+    log_band = np.full((len(offsets), log_transmat.shape[0]), -np.inf)
+    log_band[np.searchsorted(offsets, j - i), j] = log_transmat[i, j]
+    return offsets, log_band
+
+
+def minimumFrames(log_startprob, offsets, log_band):
+    """Length of the shortest path through a banded model.
+
+    Args:
+        log_startprob: log probability to start in state i
+        offsets, log_band: transitions, see transitionBand
+
+    Output:
+        smallest number of frames of a path from a start state to the last
+        state, None if the last state cannot be reached
+    """
+    states = log_band.shape[1]
+    pad = max(0, np.max(offsets))
+    sources = np.arange(states)[None, :] - offsets[:, None] + pad
+    padded = np.zeros(states + pad + max(0, -np.min(offsets)), dtype=bool)
+    reached = np.isfinite(np.ravel(log_startprob)[:states])
+    for frames in range(1, states + 1):
+        if reached[-1]:
+            return frames
+        padded[pad:pad + states] = reached
+        reached = reached | (padded[sources] & np.isfinite(log_band)).any(axis=0)
+    return None
+
+
+def bandedViterbi(log_emlik, log_startprob, offsets, log_band, final=True):
+    """Viterbi path for a model with a banded transition matrix.
+
+    Each state only looks at the K states given by the band, so every frame
+    costs O(K*M) instead of O(M*M). This is the case of forced alignment,
+    where the model is the chain of states of the transcription.
 
-    #Initialize first row of V
-    V[0, :] = log_startprob[0, :] + log_emlik[0, :]
+    Args:
+        log_emlik: NxM array of emission log likelihoods, N frames, M states
+        log_startprob: log probability to start in state i
+        offsets, log_band: transitions, see transitionBand
+        final: if True, the path has to end in the last state, as the
+               transcription has to be completed at the end of the utterance
 
-    #Propagate best paths foward
-    for o in range(1, observations):
-        V[o,:] = np.max(V[o - 1, :, None] + log_transmat[:, :], axis=0) + log_emlik[o, :]
-        B[o,:] = np.argmax(V[o - 1, :, None] + log_transmat[:, :], axis=0)
+    Output:
+        viterbi_loglik: log likelihood of the best path
+        viterbi_path: best path
 
-    lenOfShortest = np.max(V[-1, :])
+    A ValueError is raised if no path reaches the end, for example when the
+    utterance has fewer frames than the shortest path through the
+    transcription (see minimumFrames).
+    """
+    observations, states = log_emlik.shape
+    pad = max(0, np.max(offsets))
+    # source of each diagonal in the padded scores, and band aligned with it
+    sources = np.arange(states)[None, :] - offsets[:, None] + pad
+    padded = np.full(states + pad + max(0, -np.min(offsets)), -np.inf)
+    columns = np.arange(states)
+    B = np.zeros((observations - 1, states), dtype=np.min_scalar_type(len(offsets) - 1))
+
+    delta = np.ravel(log_startprob)[:states] + log_emlik[0]
+    for t in range(1, observations):
+        padded[pad:pad + states] = delta
+        scores = padded[sources] + log_band
+        best = np.argmax(scores, axis=0)
+        B[t - 1] = best
+        delta = scores[best, columns] + log_emlik[t]
+
+    state = states - 1 if final else np.argmax(delta)
+    # the backpointers are only valid on paths with a finite score
+    if not np.isfinite(delta[state]):
+        shortest = minimumFrames(log_startprob, offsets, log_band) if final else 1
+        if shortest is None:
+            raise ValueError('the last state of the model cannot be reached')
+        raise ValueError('no path through the model in %d frames, the shortest one has %d frames'
+                         % (observations, shortest))
+    bestPath = np.zeros(observations, dtype=np.intp)
+    bestPath[-1] = state
+    for t in range(observations - 2, -1, -1):
+        state = state - offsets[B[t, state]]
+        bestPath[t] = state
+    return delta[bestPath[-1]], bestPath
+
+
+def skipFrameTransitions(log_transmat, k):
+    """Transitions for skip-frame decoding.
+
+    Only every k-th frame is scored: the emissions are evaluated on
+    lmfcc[::k] and multiplied by k, since each scored frame stands for k
+    frames. The transitions between scored frames are the k-step transitions
+    A**k, which keep the expected state durations of the full rate model.
+    The results can be given to forward, viterbi or the batch versions as is,
+    and upsamplePath gives the path at the full rate.
 
-    #Extract best path
-    state = int(np.argmax(V[-1,:]))
-    bestPath = [state]
-    for o in range(observations-1, 0, -1):
-        state = int(B[o,state])
-        bestPath = [state] + bestPath
+    Args:
+        log_transmat: MxM (or WxMxM) array of log transition probabilities
+        k: number of frames per scored frame
 
-    #Return in same format as in the example
-    return (lenOfShortest,np.array(bestPath))
+    Output:
+        log of the k-th power of the transition matrix
+    """
+    with np.errstate(divide='ignore'):
+        return np.log(np.linalg.matrix_power(np.exp(log_transmat), k))
+
+
+def upsamplePath(path, k, length):
+    """Full rate path from a path decoded on every k-th frame (see skipFrameTransitions).
+
+    Args:
+        path: best path at the reduced frame rate
+        k: number of frames per scored frame
+        length: number of frames N at the full rate
+
+    Output:
+        N array where each state is repeated for the k frames it stands for
+    """
+    return np.repeat(path, k)[:length]
 
 
 def statePosteriors(log_alpha, log_beta):
@@ -183,6 +441,60 @@ def statePosteriors(log_alpha, log_beta):
     return log_alpha + log_beta - logsumexp(log_alpha[-1])
 
 
+def prunedForwardBackward(log_emlik, log_startprob, log_transmat, beam, max_active=None):
+    """Forward-backward restricted to the states that survive beam pruning.
+
+    The forward pass only keeps the states within beam of the best one at
+    each frame (see pruneStates), and the backward pass only visits those
+    states, so the cost per frame depends on the number of active states,
+    not on the size of the model.
+
+    Args:
+        log_emlik: NxM array of emission log likelihoods, N frames, M states
+        log_startprob: log probability to start in state i
+        log_transmat: transition log probability from state i to j
+        beam: log score beam for the forward pass
+        max_active: if given, at most max_active states are kept per frame
+
+    Output:
+        loglik: log likelihood of the data (restricted to the active states)
+        gamma: tuple (frames, states, values) of arrays with the non zero
+               state posteriors (not in log domain)
+        xi: MxM array with the expected number of transitions from i to j
+    """
+    observations, states = log_emlik.shape
+    alpha = np.ravel(log_startprob)[:states] + log_emlik[0]
+    actives, alphas = [], []
+    for t in range(observations):
+        if t > 0:
+            prev = actives[-1]
+            succ = np.flatnonzero(np.isfinite(log_transmat[prev]).any(axis=0))
+            alpha = np.full(states, -np.inf)
+            alpha[succ] = logsumexp(alphas[-1][:, None] + log_transmat[np.ix_(prev, succ)], axis=0) \
+                          + log_emlik[t, succ]
+        active = pruneStates(alpha, beam, max_active)
+        actives.append(active)
+        alphas.append(alpha[active])
+    loglik = logsumexp(alphas[-1])
+
+    frames, posteriorStates, values = [], [], []
+    xi = np.zeros((states, states))
+    beta = np.zeros(len(actives[-1]))
+    for t in range(observations - 1, -1, -1):
+        active = actives[t]
+        if t < observations - 1:
+            trans = log_transmat[np.ix_(active, actives[t + 1])]
+            following = log_emlik[t + 1, actives[t + 1]] + beta
+            xi[np.ix_(active, actives[t + 1])] += np.exp(alphas[t][:, None] + trans + following - loglik)
+            beta = logsumexp(trans + following, axis=1)
+        frames.append(np.full(len(active), t))
+        posteriorStates.append(active)
+        values.append(np.exp(alphas[t] + beta - loglik))
+    gamma = (np.concatenate(frames[::-1]), np.concatenate(posteriorStates[::-1]),
+             np.concatenate(values[::-1]))
+    return loglik, gamma, xi
+
+
 def updateMeanAndVar(X, log_gamma, varianceFloor=5.0):
     """ Update Gaussian parameters with diagonal covariance
 
@@ -198,30 +510,109 @@ def updateMeanAndVar(X, log_gamma, varianceFloor=5.0):
          means: MxD mean vectors for each state
          covars: MxD covariance (variance) vectors for each state
     """
-    gamma = np.exp(log_gamma)
-    prod = X[:,None,:] * gamma[:,:, None]
+    accumulator = GaussianAccumulator(log_gamma.shape[1], X.shape[1])
+    accumulator.accumulate(X, np.exp(log_gamma))
+    return accumulator.finalize(varianceFloor)
 
-    normalize = np.sum(gamma,axis=0)[:,None]
-    summed = np.sum(prod,axis=0)
-    means = summed / normalize
 
-    naivemeans = np.mean(prod, axis=0)
+class GaussianAccumulator:
+    """ Sufficient statistics for re-estimating diagonal Gaussians
 
-    diff1 = X[:,None,:]-means[None,...]
-    diff2 = diff1**2
-    diff3 = diff2 * gamma[...,None]
-    summed = np.sum(diff3, axis=0)
-    covars = np.maximum(summed/normalize, varianceFloor)
+    Keeps the state occupancies sum(gamma), and the first and second order
+    statistics gamma.T @ X and gamma.T @ X**2, so memory is O(M*D) however
+    long the data is. It can be fed one utterance at a time and finalised
+    once at the end.
 
-    return means, covars
+    Example:
+       accumulator = GaussianAccumulator(M, D)
+       for X, log_gamma in utterances:
+           accumulator.accumulate(X, np.exp(log_gamma))
+       means, covars = accumulator.finalize(varianceFloor=5.0)
+    """
+
+    def __init__(self, states, dim):
+        self.occupancy = np.zeros(states)
+        self.first = np.zeros((states, dim))
+        self.second = np.zeros((states, dim))
+
+    def accumulate(self, X, gamma, states=None):
+        """ Adds the statistics of one utterance
+
+        Args:
+             X: NxD array of feature vectors
+             gamma: NxK array of state posteriors (not in log domain)
+             states: K array with the accumulator state of each column in
+                     gamma (may repeat), if None the columns are the states
+        """
+        occupancy = np.sum(gamma, axis=0)
+        first = gamma.T @ X
+        second = gamma.T @ X**2
+        if states is None:
+            self.occupancy += occupancy
+            self.first += first
+            self.second += second
+        else:
+            np.add.at(self.occupancy, states, occupancy)
+            np.add.at(self.first, states, first)
+            np.add.at(self.second, states, second)
+
+    def accumulateSparse(self, X, frames, states, values):
+        """ Adds the statistics of one utterance from sparse posteriors
+
+        Args:
+             X: NxD array of feature vectors
+             frames, states, values: arrays with the frame, accumulator state
+                                     and posterior (not in log domain) of each
+                                     non zero entry, see prunedForwardBackward
+        """
+        weighted = values[:, None] * X[frames]
+        np.add.at(self.occupancy, states, values)
+        np.add.at(self.first, states, weighted)
+        np.add.at(self.second, states, weighted * X[frames])
+
+    def add(self, other):
+        """ Adds the statistics of another accumulator, for example from
+        another process
+        """
+        self.occupancy += other.occupancy
+        self.first += other.first
+        self.second += other.second
+
+    def finalize(self, varianceFloor=5.0, means=None, covars=None):
+        """ Maximum likelihood means and variances
+
+        Args:
+             varianceFloor: minimum allowed variance
+             means, covars: values kept for the states that were never
+                            observed (zero occupancy), zero if not given
+
+        Outputs:
+             means: MxD mean vectors for each state
+             covars: MxD covariance (variance) vectors for each state
+        """
+        seen = self.occupancy > 0
+        means = np.zeros(self.first.shape) if means is None else np.array(means, dtype=float)
+        covars = np.zeros(self.first.shape) if covars is None else np.array(covars, dtype=float)
+        norm = self.occupancy[seen, None]
+        means[seen] = self.first[seen] / norm
+        covars[seen] = self.second[seen] / norm - means[seen]**2
+        covars[seen] = np.maximum(covars[seen], varianceFloor)
+        return means, covars
 
 
 def baum_welch(lmfcc, init_means, init_covars,  log_startprob, log_trans, example_data, max_iter=20, stop_threshold=1.0):
+    """Baum-Welch re-estimation of the Gaussians of one model on one utterance.
+
+    See lab2.training.baum_welch_corpus for training the phone models on a corpus.
+
+    Output:
+        means, covars: re-estimated MxD mean and variance vectors
+    """
     means = init_means
     covars = init_covars
     log_alpha_lik = -10000000000000
     for i in range(max_iter):
-        loglikelihood = log_multivariate_normal_density_diag(lmfcc, means, covars)
+        loglikelihood = GaussianBank(means, covars).loglik(lmfcc)
         log_alpha = forward(loglikelihood, log_startprob, log_trans)
         log_beta = backward(loglikelihood, log_startprob, log_trans)
         log_gamma = statePosteriors(log_alpha, log_beta)
@@ -234,6 +625,7 @@ def baum_welch(lmfcc, init_means, init_covars,  log_startprob, log_trans, exampl
         print('iter ',i,' likelihood', np.mean(log_alpha_lik))
 
     print("Baum Welch Done!")
+    return means, covars
 
 
 
@@ -0,0 +1,37 @@
+import numpy as np
+import lab2.proto2 as proto2
+import lab2.batch as batch
+from lab2.emissions import EmissionCache
+from lab2.prondict import prondict
+from timeit import default_timer as timer
+
+# Timing and accuracy of skip-frame decoding (every k-th frame scored)
+# compared to scoring every frame
+
+#Load Data
+data = np.load('lab2_data.npz')['data']
+phoneHMMs = np.load('lab2_models.npz')['phoneHMMs'].item()
+
+namelists = [['sil'] + prondict[digit] + ['sil'] for digit in prondict.keys()]
+log_startprob, log_trans = batch.padModels([proto2.concatHMMs(phoneHMMs, names) for names in namelists])
+utterances, lengths = batch.padUtterances([utterance['lmfcc'] for utterance in data])
+digits = list(prondict.keys())
+truth = np.array([digits.index(utterance['digit']) for utterance in data])
+emissions = EmissionCache(phoneHMMs)
+
+results = {}
+for k in [1, 2, 3, 4]:
+    start = timer()
+    # only the scored frames need their emissions evaluated
+    log_emlik = batch.batchLoglik(emissions, utterances[:, ::k], namelists) * k
+    log_trans_k = proto2.skipFrameTransitions(log_trans, k)
+    skipped = -(-lengths // k)
+    forward = batch.batchForward(log_emlik, skipped, log_startprob, log_trans_k)
+    forwardTime = timer() - start
+    start = timer()
+    viterbi = batch.batchViterbi(log_emlik, skipped, log_startprob, log_trans_k)
+    viterbiTime = timer() - start + forwardTime
+    results[k] = np.argmax(forward, axis=1), np.argmax(viterbi, axis=1)
+    print('k=%d: forward accuracy %.3f (agreement %.3f) %.2f s, viterbi accuracy %.3f (agreement %.3f) %.2f s'
+          % (k, np.mean(results[k][0] == truth), np.mean(results[k][0] == results[1][0]), forwardTime,
+             np.mean(results[k][1] == truth), np.mean(results[k][1] == results[1][1]), viterbiTime))
@@ -0,0 +1,304 @@
+import numpy as np
+import copy
+from multiprocessing import Pool
+from timeit import default_timer as timer
+from lab2.tools2 import logsumexp
+from lab2.proto2 import concatHMMs, forward, backward, statePosteriors, prunedForwardBackward, \
+    transitionBand, bandedViterbi, GaussianAccumulator
+from lab2.emissions import EmissionCache, phoneStateBank
+
+# Corpus and models seen by the worker processes, set by initWorker
+_corpus = None
+
+
+def initWorker(corpus):
+    """ Makes the corpus available to a worker process once, instead of
+    sending the feature vectors with every task
+    """
+    global _corpus
+    _corpus = corpus
+
+
+def emptyStats(phoneHMMs):
+    """ Sufficient statistics with all counts set to zero
+
+    Args:
+       phoneHMMs: dictionary of phonetic Gaussian HMM models
+
+    Output:
+       dictionary with the keys
+           loglik: total log likelihood of the data
+           gaussians: GaussianAccumulator over all the states in the phone
+                      bank (in the order given by phoneStateBank)
+           transitions: dictionary with, for every phone, the (M+1)x(M+1)
+                        array of expected transition counts
+    """
+    stateList, means, covars = phoneStateBank(phoneHMMs)
+    return {'loglik': 0.0,
+            'gaussians': GaussianAccumulator(*means.shape),
+            'transitions': {phone: np.zeros(hmm['transmat'].shape)
+                            for phone, hmm in phoneHMMs.items()}}
+
+
+def addStats(stats, other):
+    """ Adds the statistics in other to stats (in place) and returns stats """
+    stats['loglik'] += other['loglik']
+    stats['gaussians'].add(other['gaussians'])
+    for phone in stats['transitions']:
+        stats['transitions'][phone] += other['transitions'][phone]
+    return stats
+
+
+def utteranceStats(stats, lmfcc, phoneTrans, phoneHMMs, emissions=None, beam=None):
+    """ Forward-backward on one utterance, adding its statistics to stats
+
+    Args:
+       stats: statistics to update, see emptyStats
+       lmfcc: NxD array of feature vectors
+       phoneTrans: list of phones in the utterance, including silence
+       phoneHMMs: current phone models
+       emissions: EmissionCache for phoneHMMs, used to map the utterance
+                  states to the phone bank (created if not given)
+       beam: if given, use the pruned forward-backward (prunedForwardBackward)
+             and only accumulate the surviving posteriors
+    """
+    if emissions is None:
+        emissions = EmissionCache(phoneHMMs)
+    hmm = concatHMMs(phoneHMMs, phoneTrans)
+    with np.errstate(divide='ignore'):
+        log_startprob = np.log(hmm['startprob'])
+        log_trans = np.log(hmm['transmat'])[:-1, :-1]
+    log_emlik = emissions.loglik(phoneTrans, lmfcc)
+    S = log_trans.shape[0]
+    xi = np.zeros((S, S + 1))
+    if beam is not None:
+        loglik, (frames, states, values), xi[:, :S] = prunedForwardBackward(log_emlik, log_startprob,
+                                                                            log_trans, beam)
+        stats['loglik'] += loglik
+        stats['gaussians'].accumulateSparse(lmfcc, frames, emissions.indices(phoneTrans)[states], values)
+        addTransitions(stats, xi, phoneTrans, phoneHMMs)
+        return
+
+    log_alpha = forward(log_emlik, log_startprob, log_trans)
+    log_beta = backward(log_emlik, log_startprob, log_trans)
+    loglik = logsumexp(log_alpha[-1])
+    gamma = np.exp(statePosteriors(log_alpha, log_beta))
+
+    # expected transition counts, the last column (leaving the utterance) stays zero
+    log_next = log_emlik[1:] + log_beta[1:]
+    for t in range(len(lmfcc) - 1):
+        xi[:, :S] += np.exp(log_alpha[t, :, None] + log_trans + log_next[t] - loglik)
+
+    stats['loglik'] += loglik
+    stats['gaussians'].accumulate(lmfcc, gamma, emissions.indices(phoneTrans))
+    addTransitions(stats, xi, phoneTrans, phoneHMMs)
+
+
+def viterbiStats(stats, lmfcc, phoneTrans, phoneHMMs, emissions=None):
+    """ Hard (segmental k-means) statistics for one utterance
+
+    The utterance is aligned with the banded Viterbi ending in the last
+    state, the same path used by forcedAlignment (see alignStates), and
+    every frame is assigned to its state on the path. Utterances that are
+    too short for their transcription add nothing to stats.
+
+    Args:
+       stats: statistics to update, see emptyStats. The log likelihood added
+              is the one of the best path
+       lmfcc: NxD array of feature vectors
+       phoneTrans: list of phones in the utterance, including silence
+       phoneHMMs: current phone models
+       emissions: EmissionCache for phoneHMMs (created if not given)
+    """
+    if emissions is None:
+        emissions = EmissionCache(phoneHMMs)
+    hmm = concatHMMs(phoneHMMs, phoneTrans)
+    S = hmm['means'].shape[0]
+    with np.errstate(divide='ignore'):
+        log_startprob = np.log(np.ravel(hmm['startprob'])[:S])
+        offsets, log_band = transitionBand(np.log(hmm['transmat'][:S, :S]))
+    log_emlik = emissions.loglik(phoneTrans, lmfcc)
+    try:
+        loglik, path = bandedViterbi(log_emlik, log_startprob, offsets, log_band)
+    except ValueError:
+        return
+
+    xi = np.zeros((S, S + 1))
+    np.add.at(xi, (path[:-1], path[1:]), 1)
+
+    stats['loglik'] += loglik
+    stats['gaussians'].accumulateSparse(lmfcc, np.arange(len(path)), emissions.indices(phoneTrans)[path],
+                                        np.ones(len(path)))
+    addTransitions(stats, xi, phoneTrans, phoneHMMs)
+
+
+def addTransitions(stats, xi, phoneTrans, phoneHMMs):
+    """ Adds utterance level transition counts to the phone transition counts
+
+    Args:
+       stats: statistics to update, see emptyStats
+       xi: Sx(S+1) array of expected transition counts between the states of
+           concatHMMs(phoneHMMs, phoneTrans), the last column is the exit
+       phoneTrans: list of phones in the utterance
+       phoneHMMs: current phone models
+    """
+    c = 0
+    for phone in phoneTrans:
+        m = phoneHMMs[phone]['means'].shape[0]
+        stats['transitions'][phone][:m] += xi[c:c + m, c:c + m + 1]
+        c += m
+
+
+def chunkStats(args):
+    """ Statistics for a range of utterances in the worker's corpus """
+    start, end, phoneHMMs, mode, beam = args
+    stats = emptyStats(phoneHMMs)
+    emissions = EmissionCache(phoneHMMs)
+    for lmfcc, phoneTrans in _corpus[start:end]:
+        if mode == 'viterbi':
+            viterbiStats(stats, lmfcc, phoneTrans, phoneHMMs, emissions)
+        else:
+            utteranceStats(stats, lmfcc, phoneTrans, phoneHMMs, emissions, beam)
+    return stats
+
+
+def updateModels(phoneHMMs, stats, varianceFloor=5.0):
+    """ M-step: new phone models from the accumulated statistics
+
+    States and transition rows that were never observed keep their old values.
+
+    Args:
+       phoneHMMs: current phone models
+       stats: accumulated statistics, see emptyStats
+       varianceFloor: minimum allowed variance
+
+    Output:
+       new dictionary of phone models in the same format as lab2_models.npz
+    """
+    newHMMs = copy.deepcopy(phoneHMMs)
+    stateList, means, covars = phoneStateBank(phoneHMMs)
+    means, covars = stats['gaussians'].finalize(varianceFloor, means, covars)
+    c = 0
+    for phone in sorted(newHMMs.keys()):
+        hmm = newHMMs[phone]
+        m = hmm['means'].shape[0]
+        hmm['means'] = means[c:c + m]
+        hmm['covars'] = covars[c:c + m]
+        c += m
+        counts = stats['transitions'][phone]
+        rows = np.sum(counts, axis=1) > 0
+        hmm['transmat'][rows] = counts[rows] / np.sum(counts[rows], axis=1, keepdims=True)
+    return newHMMs
+
+
+def savePhoneHMMs(filename, phoneHMMs):
+    """ Saves phone models in the lab2_models.npz format """
+    np.savez(filename, phoneHMMs=phoneHMMs)
+
+
+def baum_welch_corpus(corpus, phoneHMMs, max_iter=20, stop_threshold=1.0, varianceFloor=5.0,
+                      processes=None, chunksize=32, beam=None, verbose=True):
+    """ Baum-Welch training of the phone models on a whole corpus
+
+    The forward-backward pass of every utterance runs in a pool of worker
+    processes, each returning the summed statistics for a chunk of
+    utterances. These are reduced and used to re-estimate all the phone
+    models at once.
+
+    Args:
+       corpus: list of (lmfcc, phoneTrans) tuples, where phoneTrans is the
+               list of phones of the utterance including silence and short
+               pauses (as given by words2phones)
+       phoneHMMs: initial phone models, as in lab2_models.npz
+       max_iter: maximum number of EM iterations
+       stop_threshold: stop when the total log likelihood improves less
+       varianceFloor: minimum allowed variance
+       processes: number of worker processes, all cores if None, 1 to run
+                  without a pool
+       chunksize: number of utterances per task
+       beam: if given, use the posterior pruned forward-backward with this
+             log score beam (see prunedForwardBackward)
+
+    Output:
+       phoneHMMs: trained phone models
+       logliks: total log likelihood of the corpus at each iteration
+    """
+    return train_corpus(corpus, phoneHMMs, 'baum_welch', max_iter, stop_threshold, varianceFloor,
+                        processes, chunksize, beam, verbose)
+
+
+def viterbi_training_corpus(corpus, phoneHMMs, max_iter=20, stop_threshold=1.0, varianceFloor=5.0,
+                            processes=None, chunksize=32, verbose=True):
+    """ Viterbi (segmental k-means) training of the phone models on a corpus
+
+    Same as baum_welch_corpus, but every frame is assigned to the state on
+    the Viterbi best path of its utterance instead of being shared among
+    states by the posteriors. Each iteration is much cheaper, which makes it
+    useful for bootstrapping and quick retraining.
+
+    Output:
+       phoneHMMs: trained phone models
+       logliks: total best path log likelihood of the corpus at each iteration
+    """
+    return train_corpus(corpus, phoneHMMs, 'viterbi', max_iter, stop_threshold, varianceFloor,
+                        processes, chunksize, None, verbose)
+
+
+def train_corpus(corpus, phoneHMMs, mode='baum_welch', max_iter=20, stop_threshold=1.0, varianceFloor=5.0,
+                 processes=None, chunksize=32, beam=None, verbose=True):
+    """ Iterative training of the phone models on a corpus
+
+    Args:
+       mode: 'baum_welch' for soft (forward-backward) statistics or
+             'viterbi' for hard best path statistics
+       see baum_welch_corpus for the other arguments
+
+    Output:
+       phoneHMMs: trained phone models
+       logliks: total log likelihood of the corpus at each iteration
+    """
+    chunks = [(start, min(start + chunksize, len(corpus)))
+              for start in range(0, len(corpus), chunksize)]
+    pool = Pool(processes, initializer=initWorker, initargs=(corpus,)) if processes != 1 else None
+    if pool is None:
+        initWorker(corpus)
+
+    logliks = []
+    try:
+        for i in range(max_iter):
+            startTime = timer()
+            tasks = [(start, end, phoneHMMs, mode, beam) for start, end in chunks]
+            results = pool.imap_unordered(chunkStats, tasks) if pool else map(chunkStats, tasks)
+            stats = emptyStats(phoneHMMs)
+            for chunk in results:
+                addStats(stats, chunk)
+            logliks.append(stats['loglik'])
+            if verbose:
+                print('iter ', i, ' likelihood', stats['loglik'], ' time', round(timer() - startTime, 2))
+            if i > 0 and logliks[-1] - logliks[-2] < stop_threshold:
+                break
+            phoneHMMs = updateModels(phoneHMMs, stats, varianceFloor)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return phoneHMMs, logliks
+
+
+def compareTrainingModes(corpus, phoneHMMs, processes=1, chunksize=32):
+    """ Times one Viterbi training iteration against one Baum-Welch iteration
+
+    Both iterations start from the same models and use the same data.
+
+    Output:
+       baumWelchTime, viterbiTime: seconds per iteration
+    """
+    times = {}
+    for mode in ['baum_welch', 'viterbi']:
+        startTime = timer()
+        train_corpus(corpus, phoneHMMs, mode, max_iter=1, processes=processes, chunksize=chunksize,
+                     verbose=False)
+        times[mode] = timer() - startTime
+    print('Baum-Welch iteration: %.2f s, Viterbi iteration: %.2f s (%.1fx faster)'
+          % (times['baum_welch'], times['viterbi'], times['baum_welch'] / times['viterbi']))
+    return times['baum_welch'], times['viterbi']
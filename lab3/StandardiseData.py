@@ -1,9 +1,8 @@
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-from keras.utils import to_categorical
 
 
 def standardize_per_utterance(data):
+    from sklearn.preprocessing import StandardScaler
     #Fitting each utterance
     scaler = StandardScaler()
     standByUtterance = []
@@ -16,11 +15,12 @@ def standardize_per_utterance(data):
     return standByUtterance
 
 def one_hot(target):
-    return to_categorical(target,61).transpose()  #61 = the amount of possible states
+    return np.eye(61, dtype='float32')[target].transpose()  #61 = the amount of possible states
 
 def standardize_per_training_set(trainingData,validationData,testData):
     #trainingData = np.load(trainingFname)['data']
     #testData = np.load(testFname)['data']
+    from sklearn.preprocessing import StandardScaler
 
     fitData = [d['lmfcc'] for d in trainingData]
     fitData = np.vstack(fitData)
@@ -50,11 +50,19 @@ def standardize_per_training_set(trainingData,validationData,testData):
 
     return trainingSet,validationSet ,testSet
 
-def add_id_and_gender(data):
+def add_id_and_gender(data, manifest=None):
+    # The speaker and gender are read from the corpus manifest when given
+    # (see lab3/manifest.py), otherwise parsed from the file names
+    index = {row['path']: row for row in manifest} if manifest is not None else {}
     for i in range(0,len(data)):
-        splitted = data[i]['filename'].split("/")
-        data[i]['gender'] = splitted[-3]
-        data[i]['id'] = splitted[-2]
+        entry = index.get(data[i]['filename'])
+        if entry is not None:
+            data[i]['gender'] = str(entry['gender'])
+            data[i]['id'] = str(entry['speaker'])
+        else:
+            splitted = data[i]['filename'].split("/")
+            data[i]['gender'] = splitted[-3]
+            data[i]['id'] = splitted[-2]
     return data
 
 def get_data_by_speaker(data):
@@ -68,8 +76,9 @@ def get_data_by_speaker(data):
     return dataBySpeaker
 
 
-def standardize_per_speaker(data):
-    data = add_id_and_gender(data)
+def standardize_per_speaker(data, manifest=None):
+    from sklearn.preprocessing import StandardScaler
+    data = add_id_and_gender(data, manifest)
     dataBySpeaker = get_data_by_speaker(data)
 
     data = []
@@ -85,11 +94,11 @@ def standardize_per_speaker(data):
 
     return data
 
-def get_training_and_validation_sets(trainingData):
+def get_training_and_validation_sets(trainingData, manifest=None):
     men = []
     women = []
     a = len(trainingData)
-    trainingData = add_id_and_gender(trainingData)
+    trainingData = add_id_and_gender(trainingData, manifest)
     trainingData = get_data_by_speaker(trainingData)
     keys = trainingData.keys()
 
@@ -0,0 +1,101 @@
+import os
+import hashlib
+import numpy as np
+from lab3.lab3_proto import batchAlignment
+
+
+def modelKey(phoneHMMs):
+    """ Hash of a set of phone models, changes whenever any parameter changes """
+    h = hashlib.sha1()
+    for phone in sorted(phoneHMMs.keys()):
+        h.update(phone.encode())
+        for name in ['startprob', 'transmat', 'means', 'covars']:
+            h.update(np.ascontiguousarray(phoneHMMs[phone][name], dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def alignmentKey(lmfcc, phoneTrans, models):
+    """ Hash of everything an alignment depends on
+
+    Args:
+       lmfcc: NxD array of feature vectors
+       phoneTrans: phone transcription of the utterance
+       models: key of the phone models, see modelKey
+    """
+    h = hashlib.sha1(models.encode())
+    h.update(' '.join(phoneTrans).encode())
+    h.update(str(lmfcc.shape).encode())
+    h.update(np.ascontiguousarray(lmfcc, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+class AlignmentCache:
+    """ State alignments stored per utterance, recomputed only when needed
+
+    Each entry keeps the key of the features, transcription and models it
+    was computed from (see alignmentKey). When aligning again, only the
+    utterances whose key changed are realigned.
+
+    Example:
+       cache = AlignmentCache('train_alignments.npz')
+       targets = cache.align(filenames, lmfccs, phoneTranses, phoneHMMs)
+       cache.save()
+    """
+
+    def __init__(self, filename):
+        """
+        Args:
+           filename: npz file of the cache, loaded if it exists
+        """
+        self.filename = filename
+        self.entries = {}
+        if os.path.exists(filename):
+            self.entries = np.load(filename, allow_pickle=True)['entries'].item()
+
+    def align(self, names, lmfccs, phoneTranses, phoneHMMs, verbose=True):
+        """ Alignments of a corpus, reusing the cached ones that are still valid
+
+        Args:
+           names: list of utterance names (for example the file names)
+           lmfccs: list of NxD arrays of feature vectors
+           phoneTranses: list of phone transcriptions
+           phoneHMMs: phone models
+           verbose: print how many utterances were realigned and, among the
+                    ones that were in the cache before, how many frames
+                    changed state
+
+        Output:
+           list with an N array of state IDs for each utterance, see
+           batchAlignment, None for the utterances that could not be
+           aligned (too short for their transcription). These are not
+           cached and are tried again on the next call
+        """
+        models = modelKey(phoneHMMs)
+        keys = [alignmentKey(lmfcc, phoneTrans, models) for lmfcc, phoneTrans in zip(lmfccs, phoneTranses)]
+        stale = [i for i, (name, key) in enumerate(zip(names, keys))
+                 if name not in self.entries or self.entries[name][0] != key]
+        changed = compared = 0
+        failed = []
+        if stale:
+            aligned = batchAlignment([lmfccs[i] for i in stale], [phoneTranses[i] for i in stale], phoneHMMs)
+            for i, targets in zip(stale, aligned):
+                if targets is None:
+                    failed.append(names[i])
+                    self.entries.pop(names[i], None)
+                    continue
+                if names[i] in self.entries:
+                    old = self.entries[names[i]][1]
+                    if len(old) == len(targets):
+                        changed += np.count_nonzero(old != targets)
+                        compared += len(targets)
+                self.entries[names[i]] = (keys[i], targets)
+        if verbose:
+            print('realigned %d of %d utterances, %d of %d previously aligned frames changed state'
+                  % (len(stale), len(names), changed, compared))
+            for name in failed:
+                print('could not align %s, too short for its transcription' % name)
+        return [self.entries[name][1] if name in self.entries else None for name in names]
+
+    def save(self):
+        """ Writes the cache to its file """
+        np.savez(self.filename, entries=self.entries)
@@ -39,7 +39,7 @@ def groupedList(data):
 statlist = pickle.load(open('stateList.pkl', 'rb'))
 p = np.load('predicted_test.npy')
 
-train, validation = get_training_and_validation_sets(np.load('train_data.npz')['data'])
+train, validation = get_training_and_validation_sets(np.load('train_data.npz')['data'], np.load('train_manifest.npy'))
 _, __, test_data = standardize_per_training_set(train, [], np.load('test_data.npz')['data'])
 
 print('processing data for input')
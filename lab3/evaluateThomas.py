@@ -26,7 +26,7 @@ NUM_STACK = 5
 statlist = pickle.load(open('stateList.pkl', 'rb'))
 p = np.load('predicted_test.npy')
 
-train, validation = get_training_and_validation_sets(np.load('G:/train_data.npz')['data'])
+train, validation = get_training_and_validation_sets(np.load('G:/train_data.npz')['data'], np.load('G:/train_manifest.npy'))
 _, __, test_data = standardize_per_training_set(train, [], np.load('G:/test_data.npz')['data'])
 
 print('processing data for input')
@@ -3,70 +3,87 @@ import pickle
 from lab3.lab3_proto import *
 from lab1.proto import mfcc
 from lab2.prondict import prondict
-import os
+from lab2.phonebank import loadPhoneBank
+from lab3.alignmentcache import AlignmentCache
+from lab3.manifest import updateManifest
 from queue import Queue
 from threading import Thread
 SET = 'train' # test/train
 THREADS = 20
 
-phoneHMMs = np.load('lab3/lab2_models.npz')['phoneHMMs'].item()
-phones = sorted(phoneHMMs.keys())
-nstates = {phone: phoneHMMs[phone]['means'].shape[0] for phone in phones}
-stateList = [ph + '_' + str(id) for ph in phones for id in range(nstates[ph])]
+# lab3/phonebank is rebuilt from lab3/lab2_models.npz whenever the models change
+bank = loadPhoneBank('lab3/phonebank', 'lab3/lab2_models.npz')
+phoneHMMs = bank.hmms()
+stateList = bank.stateList
 
 
 threads = []
-def threading(q:Queue, ret_q:Queue):
+def threading(q:Queue, ret_q:Queue, manifest):
     data = []
     for i in range(THREADS):
         worker = Thread(target=work, args=(q,ret_q))
         threads.append(worker)
         worker.start()
 
+    # Feed the workers with the audio read ahead by the prefetching reader,
+    # the workers are stopped even if reading fails
+    try:
+        for meta, samples in prefetchAudio(manifest):
+            q.put((meta['path'], meta['digits'], samples))
+    finally:
+        for i in range(THREADS):
+            q.put(None)
+
     for t in threads:
         # Blocking
         t.join()
 
     while not ret_q.empty():
-        fname, aligned, lmfcc, mspec = ret_q.get()
-        data.append({'filename': fname, 'lmfcc': lmfcc, 'mspec': mspec, 'targets': aligned})
+        fname, phoneTrans, lmfcc, mspec = ret_q.get()
+        data.append({'filename': fname, 'lmfcc': lmfcc, 'mspec': mspec, 'phoneTrans': phoneTrans})
+
+    # Align all the utterances at once, in buckets of similar length, only
+    # realigning the ones whose features, transcription or models changed
+    cache = AlignmentCache('%s_alignments.npz' % SET)
+    targets = cache.align([d['filename'] for d in data], [d['lmfcc'] for d in data],
+                          [d.pop('phoneTrans') for d in data], phoneHMMs)
+    cache.save()
+    for d, aligned in zip(data, targets):
+        d['targets'] = None if aligned is None else list(aligned)
+    # the utterances that could not be aligned are left out
+    data = [d for d in data if d['targets'] is not None]
 
     np.savez('%s_data.npz' % SET, data=data)
     print('Done!!')
 
 def work(q:Queue, ret_q:Queue):
-    while not q.empty():
-        fname = q.get()
-        aligned, lmfcc, mspec = gen(fname)
-        ret_q.put((fname, aligned, lmfcc, mspec))
+    while True:
+        item = q.get()
+        if item is None:
+            break
+        fname, digits, samples = item
+        phoneTrans, lmfcc, mspec = gen(fname, digits, samples)
+        ret_q.put((fname, phoneTrans, lmfcc, mspec))
         q.task_done()
 
-def gen(fname):
+def gen(fname, digits, samples):
     print(fname)
-    samples, samplingrate = loadAudio(fname)
     lmfcc, mspec = mfcc(samples, liftering=False)
 
-    wordTrans = list(path2info(fname)[2])
+    wordTrans = list(digits)
     phoneTrans = words2phones(wordTrans, prondict, addShortPause=True)
-    hmms = concatHMMs(phoneHMMs, phoneTrans)
-    stateTrans = [phone + '_' + str(stateid) for phone in phoneTrans
-                  for stateid in range(nstates[phone])]
-    stateTrans_idx = list(map(stateList.index, stateTrans))
-    aligned = forcedAlignment(lmfcc, hmms, stateTrans_idx)
 
-    return aligned, lmfcc, mspec
+    return phoneTrans, lmfcc, mspec
 
-q = Queue()
+q = Queue(maxsize=2 * THREADS)
 ret_q = Queue()
 i = 0
 disc = 'disc_4.1.1' if SET == 'train' else 'disc_4.2.1'
-for root, dirs, files in os.walk('lab3/asset/tidigits/%s/tidigits/%s' % (disc, SET)):
-    for file in files:
-        if file.endswith('.wav'):
-            fname = os.path.join(root, file)
-            q.put(fname)
+# The file list comes from the manifest, rescanned on every run: only the
+# files added or modified since the last run are parsed again
+manifest = updateManifest('lab3/%s_manifest.npy' % SET, 'lab3/asset/tidigits/%s/tidigits/%s' % (disc, SET))
 
-threading(q, ret_q)
+threading(q, ret_q, manifest)
 
 
 # aligned, lmfcc = gen(fname)
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+import numpy as np
+from timeit import default_timer as timer
+
+# Import time of the lab modules, each one in a fresh interpreter as in the
+# batch workers. Run from the repository root.
+MODULES = ['numpy', 'lab1.proto', 'lab2.proto2', 'lab3.lab3_tools', 'lab3.lab3_proto', 'lab3.StandardiseData']
+# Optional dependencies that should only be imported on first use
+HEAVY = ['matplotlib', 'sklearn', 'keras', 'soundfile', 'pysndfile']
+REPEAT = 10
+
+check = 'import sys, %s; print(" ".join(m for m in %r if m in sys.modules))'
+for module in MODULES:
+    times = []
+    for i in range(REPEAT):
+        start = timer()
+        out = subprocess.run([sys.executable, '-c', check % (module, HEAVY)], capture_output=True, text=True)
+        times.append(timer() - start)
+    loaded = out.stdout.strip() if out.returncode == 0 else 'import failed: ' + out.stderr.strip().split('\n')[-1]
+    print('%-22s %6.1f ms  %s' % (module, 1000 * np.median(times), loaded))
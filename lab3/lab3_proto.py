@@ -2,6 +2,8 @@ import numpy as np
 from lab3.lab3_tools import *
 
 from lab2.proto2 import *
+from lab2.emissions import EmissionCache, GaussianBank
+from lab2 import batch
 
 def words2phones(wordList, pronDict, addSilence=True, addShortPause=False):
     """ word2phones: converts word level to phone level transcription adding silence
@@ -29,51 +31,6 @@ def words2phones(wordList, pronDict, addSilence=True, addShortPause=False):
 
     return phones
 
-def concatHMMs(hmmmodels, namelist):
-    """ Concatenates HMM models in a left to right manner
-
-    Args:
-       hmmmodels: list of dictionaries with the following keys:
-           name: phonetic or word symbol corresponding to the model
-           startprob: M+1 array with priori probability of state
-           transmat: (M+1)x(M+1) transition matrix
-           means: MxD array of mean vectors
-           covars: MxD array of variances
-       namelist: list of model names that we want to concatenate
-
-    D is the dimension of the feature vectors
-    M is the number of states in each HMM model (could be different for each)
-
-    Output
-       combinedhmm: dictionary with the same keys as the input but
-                    combined models
-
-    Example:
-       wordHMMs['o'] = concatHMMs(phoneHMMs, ['sil', 'ow', 'sil'])
-    """
-    wordHmm = copy.deepcopy(hmmmodels[namelist[0]])
-    states = namelist.count('sp') + (len(namelist) - namelist.count('sp'))*3
-    d = 4*len(namelist)-(len(namelist)-1)
-    wordHmm['transmat'] = np.zeros((states+1,states+1))
-    wordHmm['means'] = np.zeros((states,13))
-    wordHmm['covars'] = np.zeros((states, 13))
-    wordHmm['startprob'] = np.zeros((1, states))
-    wordHmm['startprob'][0,0] = 1
-    c = 0
-    for i in range(0,len(namelist)):
-        if (namelist[i] == 'sp'):
-            wordHmm['transmat'][c:c + 2, c:c + 2] = hmmmodels[namelist[i]]['transmat']
-            wordHmm['means'][c:c + 1, :] = hmmmodels[namelist[i]]['means']
-            wordHmm['covars'][c:c + 1, :] = hmmmodels[namelist[i]]['covars']
-            c += 1
-        else:
-            wordHmm['transmat'][c:c+4, c:c+4] = hmmmodels[namelist[i]]['transmat']
-            wordHmm['means'][c:c+3,:] = hmmmodels[namelist[i]]['means']
-            wordHmm['covars'][c:c + 3, :] = hmmmodels[namelist[i]]['covars']
-            c += 3
-    wordHmm['transmat'][-1, -1] = 1
-    return wordHmm
-
 def forcedAlignment(lmfcc, phoneHMMs, phoneTrans):
     """ forcedAlignmen: aligns a phonetic transcription at the state level
 
@@ -88,12 +45,86 @@ def forcedAlignment(lmfcc, phoneHMMs, phoneTrans):
        list of strings in the form phoneme_index specifying, for each time step
        the state from phoneHMMs corresponding to the viterbi path.
     """
-    log_emlik = log_multivariate_normal_density_diag(lmfcc, phoneHMMs['means'], phoneHMMs['covars'])
-    transmat = phoneHMMs['transmat'][:-1, :-1]
-    states = viterbi(log_emlik,phoneHMMs['startprob'],transmat)[1]
+    states = alignStates(lmfcc, phoneHMMs)[0]
     aligned = [phoneTrans[s] for s in states]
     return aligned
 
+def alignStates(lmfcc, hmm, stateIds=None):
+    """ Forced alignment with the banded Viterbi, ending in the last state
+
+    Args:
+       lmfcc: NxD array of MFCC feature vectors
+       hmm: model of the transcription, as returned by concatHMMs
+       stateIds: optional S array with the integer ID of each state of hmm,
+                 for example PhoneBank.stateIds(phoneTrans)
+
+    Returns:
+       aligned: N array with the state of each frame (an index into stateIds,
+                or the ID if stateIds is given)
+       segments: Kx3 array with one (state, first frame, last frame) row for
+                 each run of frames in the same state
+
+    A ValueError is raised if the utterance is too short for the
+    transcription, see bandedViterbi.
+    """
+    log_emlik = GaussianBank(hmm['means'], hmm['covars']).loglik(lmfcc)
+    S = log_emlik.shape[1]
+    with np.errstate(divide='ignore'):
+        log_startprob = np.log(np.ravel(hmm['startprob'])[:S])
+        offsets, log_band = transitionBand(np.log(hmm['transmat'][:S, :S]))
+    aligned = bandedViterbi(log_emlik, log_startprob, offsets, log_band)[1]
+    if stateIds is not None:
+        aligned = np.asarray(stateIds)[aligned]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(aligned)) + 1))
+    ends = np.concatenate((starts[1:] - 1, [len(aligned) - 1]))
+    return aligned, np.stack([aligned[starts], starts, ends], axis=1)
+
+def batchAlignment(lmfccs, phoneTranses, phoneHMMs, maxWaste=0.25, maxCells=2**24):
+    """ Forced alignment of many utterances, a bucket of similar size at a time
+
+    Gives the same alignments as alignStates on each utterance, but the
+    Viterbi recursion runs on all the utterances of a bucket together (see
+    lengthBuckets for maxWaste and maxCells).
+
+    Args:
+       lmfccs: list of NxD arrays of MFCC feature vectors
+       phoneTranses: list with the phone transcription of each utterance,
+                     including silence and short pauses
+       phoneHMMs: dictionary of phonetic Gaussian HMM models
+
+    Returns:
+       list with an N array of state IDs for each utterance, the indices of
+       the states in the phone bank (the same as PhoneBank.stateIds), or
+       None for the utterances that are too short for their transcription
+    """
+    emissions = EmissionCache(phoneHMMs)
+    ids = [emissions.indices(phoneTrans) for phoneTrans in phoneTranses]
+    lengths = np.array([len(lmfcc) for lmfcc in lmfccs])
+    nstates = np.array([len(i) for i in ids])
+    aligned = [None] * len(lmfccs)
+    for bucket in batch.lengthBuckets(lengths, nstates, maxWaste, maxCells):
+        U, T, M = len(bucket), lengths[bucket].max(), nstates[bucket].max()
+        log_emlik = np.full((U, T, M), -np.inf)
+        log_startprob = np.full((U, M), -np.inf)
+        bands = []
+        for u, i in enumerate(bucket):
+            S = nstates[i]
+            hmm = concatHMMs(phoneHMMs, phoneTranses[i])
+            log_emlik[u, :lengths[i], :S] = emissions.bank.loglik(lmfccs[i], ids[i])
+            with np.errstate(divide='ignore'):
+                log_startprob[u, :S] = np.log(np.ravel(hmm['startprob'])[:S])
+                bands.append(transitionBand(np.log(hmm['transmat'][:S, :S])))
+        offsets = np.unique(np.concatenate([band[0] for band in bands]))
+        log_band = np.full((U, len(offsets), M), -np.inf)
+        for u, (off, band) in enumerate(bands):
+            log_band[u, np.searchsorted(offsets, off), :band.shape[1]] = band
+        loglik, paths = batch.batchBandedViterbi(log_emlik, lengths[bucket], nstates[bucket], log_startprob,
+                                                 offsets, log_band)
+        for u, i in enumerate(bucket):
+            if np.isfinite(loglik[u]):
+                aligned[i] = ids[i][paths[u, :lengths[i]]]
+    return aligned
+
 # compile with SSE4.1, SSE4.2, AVX, AVX2, l
 
 
@@ -124,3 +155,163 @@ def hmmLoop(hmmmodels, namelist=None):
        phoneLoop = hmmLoop(phoneHMMs)
        wordLoop = hmmLoop(wordHMMs, ['o', 'z', '1', '2', '3'])
     """
+    if namelist is None:
+        namelist = list(hmmmodels.keys())
+    nstates = [hmmmodels[name]['means'].shape[0] for name in namelist]
+    states = sum(nstates)
+    dim = hmmmodels[namelist[0]]['means'].shape[1]
+    combinedhmm = {'name': 'loop',
+                   'startprob': np.zeros((1, states)),
+                   'transmat': np.zeros((states + 1, states + 1)),
+                   'means': np.zeros((states, dim)),
+                   'covars': np.zeros((states, dim))}
+    stateMap = []
+    exitprob = np.zeros(states)
+    c = 0
+    for name, m in zip(namelist, nstates):
+        hmm = hmmmodels[name]
+        combinedhmm['transmat'][c:c + m, c:c + m] = hmm['transmat'][:m, :m]
+        combinedhmm['startprob'][0, c:c + m] = np.ravel(hmm['startprob'])[:m] / len(namelist)
+        combinedhmm['means'][c:c + m] = hmm['means']
+        combinedhmm['covars'][c:c + m] = hmm['covars']
+        exitprob[c:c + m] = hmm['transmat'][:m, m]
+        stateMap += [(name, i) for i in range(m)]
+        c += m
+    # Leaving any model means entering any model (including itself)
+    combinedhmm['transmat'][:-1, :-1] += np.outer(exitprob, combinedhmm['startprob'][0])
+    combinedhmm['transmat'][-1, -1] = 1
+    return combinedhmm, stateMap
+
+
+def tokenPassing(log_emlik, hmmmodels, stateMap, fillers=('sil', 'sp'), beam=None, wordPenalty=0.0):
+    """ One pass connected word Viterbi decoding over a loop of models
+
+    Args:
+       log_emlik: NxS array of emission log likelihoods for the states of the loop
+       hmmmodels: dictionary of the models in the loop (as given to hmmLoop)
+       stateMap: map between loop states and model states, as returned by hmmLoop
+       fillers: names of models (silence, short pause) that can be entered
+                like words but are left out of the recognised sequence
+       beam: if given, states more than beam below the best one are pruned
+             and only the remaining ones are propagated (see pruneStates)
+       wordPenalty: log probability added every time a word (not a filler)
+                    is entered, negative values give fewer insertions
+
+    Output:
+       list of (word, start, end) tuples with the recognised words and the
+       first and last frame of each word
+
+    Every state carries the best token that reached it. At each frame the
+    tokens leaving the models are recombined: only the best one is kept,
+    recorded as a word end, and passed on to the entry states of all models.
+    The word ends form a linked list that is traced back at the end.
+    """
+    N, S = log_emlik.shape
+    names = []
+    for name, i in stateMap:
+        if i == 0:
+            names.append(name)
+    model = np.array([names.index(name) for name, i in stateMap])
+
+    log_trans = np.full((S, S), -np.inf)
+    log_exit = np.full(S, -np.inf)
+    log_entry = np.full(S, -np.inf)
+    with np.errstate(divide='ignore'):
+        c = 0
+        for name in names:
+            hmm = hmmmodels[name]
+            m = hmm['means'].shape[0]
+            penalty = 0.0 if name in fillers else wordPenalty
+            log_trans[c:c + m, c:c + m] = np.log(hmm['transmat'][:m, :m])
+            log_exit[c:c + m] = np.log(hmm['transmat'][:m, m])
+            log_entry[c:c + m] = np.log(np.ravel(hmm['startprob'])[:m]) - np.log(len(names)) + penalty
+            c += m
+
+    # word end records: model, last frame and previous record
+    endModel, endFrame, endPrev = [], [], []
+
+    delta = log_entry + log_emlik[0]
+    history = np.full(S, -1)
+    for t in range(1, N):
+        if beam is not None:
+            active = pruneStates(delta, beam)
+            kept = np.full(S, -np.inf)
+            kept[active] = delta[active]
+            delta = kept
+
+        # recombine the tokens leaving the models
+        leaving = delta + log_exit
+        best = np.argmax(leaving)
+        endModel.append(model[best])
+        endFrame.append(t - 1)
+        endPrev.append(history[best])
+
+        if beam is None:
+            scores = delta[:, None] + log_trans
+            pred = np.argmax(scores, axis=0)
+            within = scores[pred, np.arange(S)]
+        else:
+            # only propagate the active states to the states they can reach
+            succ = np.flatnonzero(np.isfinite(log_trans[active]).any(axis=0))
+            scores = delta[active, None] + log_trans[np.ix_(active, succ)]
+            local = np.argmax(scores, axis=0)
+            within = np.full(S, -np.inf)
+            within[succ] = scores[local, np.arange(len(succ))]
+            pred = np.zeros(S, dtype=np.intp)
+            pred[succ] = active[local]
+        entering = leaving[best] + log_entry
+        enter = entering > within
+        delta = np.where(enter, entering, within) + log_emlik[t]
+        history = np.where(enter, len(endModel) - 1, history[pred])
+
+    leaving = delta + log_exit
+    best = np.argmax(leaving)
+    if not np.isfinite(leaving[best]):
+        best = np.argmax(delta)
+    endModel.append(model[best])
+    endFrame.append(N - 1)
+    endPrev.append(history[best])
+
+    words = []
+    record = len(endModel) - 1
+    while record >= 0:
+        prev = endPrev[record]
+        start = endFrame[prev] + 1 if prev >= 0 else 0
+        if names[endModel[record]] not in fillers:
+            words.append((names[endModel[record]], start, endFrame[record]))
+        record = prev
+    return words[::-1]
+
+
+def recognizeWords(lmfcc, phoneHMMs, pronDict, wordList=None, fillers=('sil', 'sp'), beam=None, wordPenalty=0.0):
+    """ Connected word recognition with a loop of word models
+
+    Args:
+       lmfcc: NxD array of MFCC feature vectors
+       phoneHMMs: set of phonetic Gaussian HMM models
+       pronDict: pronunciation dictionary
+       wordList: words in the loop, all the words in pronDict if None
+       fillers: phone models added to the loop as silence/pause fillers
+       beam, wordPenalty: see tokenPassing
+
+    Output:
+       list of (word, start, end) tuples, see tokenPassing
+
+    Example:
+       recognizeWords(lmfcc, phoneHMMs, prondict)  # [('z', 20, 68), ('4', 69, 112), ...]
+    """
+    if wordList is None:
+        wordList = sorted(pronDict.keys())
+    phoneLists = {word: pronDict[word] for word in wordList}
+    phoneLists.update({filler: [filler] for filler in fillers})
+    names = list(wordList) + list(fillers)
+    wordHMMs = {name: concatHMMs(phoneHMMs, phoneLists[name]) for name in names}
+    # tokenPassing builds the loop transitions itself, only the state map of
+    # hmmLoop is needed
+    stateMap = [(name, i) for name in names for i in range(wordHMMs[name]['means'].shape[0])]
+
+    # the loop repeats phone states, evaluate each of them only once
+    emissions = EmissionCache(phoneHMMs)
+    emissions.update(lmfcc)
+    log_emlik = emissions.loglik([phone for name in names for phone in phoneLists[name]])
+    return tokenPassing(log_emlik, wordHMMs, stateMap, fillers, beam, wordPenalty)
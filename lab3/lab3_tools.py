@@ -1,7 +1,5 @@
 import numpy as np
 import os
-#from pysoundfile import sndio
-import soundfile as sndio
 
 
 def path2info(path):
@@ -31,14 +29,104 @@ def loadAudio(filename):
     in the int16 range instead. In order to compute features that are
     compatible with the models, we have to follow the same procedure again.
     This will be simplified in future years.
+
+    The samples are returned as int16, a quarter of the size of the floats.
+    enframe converts them to float with the same scaling as above.
     """
-    sndobj = sndio.read(filename)
-    samplingrate = sndobj[1]
-    samples = np.array(sndobj[0])*np.iinfo(np.int16).max
+    # soundfile is only needed to read audio, not to import the lab tools
+    import soundfile as sndio
+    samples, samplingrate = sndio.read(filename, dtype='int16')
     return samples, samplingrate
 
 
-def frames2trans(sequence, outfilename=None, timestep=0.01):
+def runLengths(sequence):
+    """
+    runLengths: run-length encoding of a frame-by-frame sequence
+
+    Args:
+       sequence: array like of N labels (integers or strings)
+
+    Returns:
+       values: label of each run
+       starts: first frame of each run
+       ends: frame after the last frame of each run
+    """
+    sequence = np.asarray(sequence)
+    if len(sequence) == 0:
+        return sequence, np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    starts = np.concatenate(([0], np.flatnonzero(sequence[1:] != sequence[:-1]) + 1))
+    ends = np.append(starts[1:], len(sequence))
+    return sequence[starts], starts, ends
+
+def prefetchAudio(entries, queuesize=8, blocksize=2**20):
+    """
+    prefetchAudio: reads audio files ahead of their use, in a background thread
+
+    The files are read in large sequential blocks and decoded as in loadAudio
+    while the caller processes the previous ones. At most queuesize decoded
+    files wait in memory.
+
+    Args:
+       entries: list of file names or of manifest rows (see lab3.manifest)
+       queuesize: number of decoded files kept ahead
+       blocksize: size in bytes of each read
+
+    Returns:
+       generator of (metadata, samples) in the order of entries, where
+       metadata is a dictionary with the path, the samplingrate and the
+       fields of the manifest row if given
+
+    Example:
+       for meta, samples in prefetchAudio(manifest):
+           lmfcc = mfcc(samples)
+    """
+    import io
+    import queue
+    import threading
+    q = queue.Queue(maxsize=queuesize)
+    stop = threading.Event()
+
+    def put(item):
+        # give up if the consumer stopped iterating
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for entry in entries:
+                if isinstance(entry, str):
+                    meta = {'path': entry}
+                else:
+                    meta = {name: entry[name].item() for name in entry.dtype.names}
+                with open(meta['path'], 'rb') as f:
+                    data = b''.join(iter(lambda: f.read(blocksize), b''))
+                samples, meta['samplingrate'] = loadAudio(io.BytesIO(data))
+                if not put((meta, samples)):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def frames2trans(sequence, outfilename=None, timestep=0.01, symbols=None):
     """
     Outputs a standard transcription given a frame-by-frame
     list of strings.
@@ -48,21 +136,32 @@ def frames2trans(sequence, outfilename=None, timestep=0.01):
     trans = frames2trans(phones, 'oa.lab')
 
     Then you can use, for example wavesurfer to open the wav file and the transcription
+
+    The sequence can also hold integer IDs (for example state IDs from the
+    alignment), with symbols the list of names of the IDs (e.g. stateList).
+    The times are computed from the frame indices, so they do not accumulate
+    rounding errors.
     """
-    sym = sequence[0]
-    start = 0
-    end = 0
-    trans = ''
-    for t in range(len(sequence)):
-        if sequence[t] != sym:
-            trans = trans + str(start) + ' ' + str(end) + ' ' + sym + '\n'
-            sym = sequence[t]
-            start = end
-        end = end + timestep
-    trans = trans + str(start) + ' ' + str(end) + ' ' + sym + '\n'
+    values, starts, ends = runLengths(sequence)
+    if symbols is not None:
+        values = np.asarray(symbols)[values]
+    trans = ''.join('%.10g %.10g %s\n' % (start * timestep, end * timestep, sym)
+                    for start, end, sym in zip(starts, ends, values))
     if outfilename != None:
         with open(outfilename, 'w') as f:
             f.write(trans)
     return trans
 
+def writeTranscriptions(sequences, outfilenames, timestep=0.01, symbols=None):
+    """
+    Writes the transcriptions of a whole corpus, one .lab file per utterance
+
+    Args:
+       sequences: list of frame-by-frame label sequences, see frames2trans
+       outfilenames: list of output file names, one per sequence
+       timestep, symbols: see frames2trans
+    """
+    for sequence, outfilename in zip(sequences, outfilenames):
+        frames2trans(sequence, outfilename, timestep, symbols)
+
         
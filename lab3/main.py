@@ -7,6 +7,7 @@ from lab3.lab3_proto import *
 import lab2.proto2 as proto2
 from lab1.proto import mfcc
 from lab2.prondict import prondict
+from lab2.phonebank import loadPhoneBank
 #Get stateList
 '''
 
@@ -15,10 +16,9 @@ from lab2.prondict import prondict
 #    pickle.dump(stateList, f)
 '''
 
-phoneHMMs = np.load('lab3/lab2_models.npz')['phoneHMMs'].item()
-phones = sorted(phoneHMMs.keys())
-nstates = {phone: phoneHMMs[phone]['means'].shape[0] for phone in phones}
-stateList = [ph + '_' + str(id) for ph in phones for id in range(nstates[ph])]
+bank = loadPhoneBank('lab3/phonebank', 'lab3/lab2_models.npz')
+phoneHMMs = bank.hmms()
+stateList = bank.stateList
 # with open('lab3/stateList.pkl', 'rb') as f:
 #     stateList = pickle.load(f)
 
@@ -31,9 +31,8 @@ lmfcc = mfcc(samples)
 wordTrans = list(path2info(fname)[2])
 phoneTrans = words2phones(wordTrans,prondict, addShortPause=True)
 hmms = concatHMMs(phoneHMMs,phoneTrans)
-stateTrans = [phone + '_' + str(stateid) for phone in phoneTrans
-                  for stateid in range(nstates[phone])]
-stateTrans_idx = list(map(stateList.index,stateTrans))
+stateTrans_idx = bank.stateIds(phoneTrans)
+stateTrans = [stateList[i] for i in stateTrans_idx]
 aligned = forcedAlignment(lmfcc, hmms, stateTrans)
 
 frames2trans(aligned, outfilename='z43a.lab')
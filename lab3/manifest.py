@@ -0,0 +1,88 @@
+import os
+import numpy as np
+from lab3.lab3_tools import path2info
+
+# One row per audio file of the corpus
+PATH_LENGTH = 256
+MANIFEST_DTYPE = [('path', 'U%d' % PATH_LENGTH), ('size', 'i8'), ('mtime', 'f8'), ('gender', 'U8'), ('speaker', 'U8'),
+                  ('digits', 'U16'), ('repetition', 'U1'), ('duration', 'f8')]
+
+
+def updateManifest(filename, root, extension='.wav'):
+    """ Builds or updates the manifest of the audio files under root
+
+    Files whose size and modification time did not change keep their
+    entry, only new or modified files are parsed and have their header read.
+    Files that disappeared are dropped. The manifest is saved to filename.
+    A ValueError is raised for paths longer than PATH_LENGTH, which the path
+    field would truncate.
+
+    Args:
+       filename: .npy file of the manifest, read first if it exists
+       root: directory of the corpus, for example
+             'lab3/asset/tidigits/disc_4.1.1/tidigits/train'
+       extension: extension of the audio files
+
+    Output:
+       manifest: structured array with the fields of MANIFEST_DTYPE, sorted
+                 by path
+    """
+    import soundfile
+    old = {}
+    if os.path.exists(filename):
+        old = {row['path']: row for row in np.load(filename)}
+    rows = []
+    for dirpath, dirnames, files in os.walk(root):
+        for file in files:
+            if not file.endswith(extension):
+                continue
+            path = os.path.join(dirpath, file)
+            stat = os.stat(path)
+            row = old.get(path)
+            if row is not None and row['size'] == stat.st_size and row['mtime'] == stat.st_mtime:
+                rows.append(row)
+                continue
+            if len(path) > PATH_LENGTH:
+                raise ValueError('path longer than %d characters, cannot be stored in the manifest: %s'
+                                 % (PATH_LENGTH, path))
+            gender, speaker, digits, repetition = path2info(path)
+            rows.append((path, stat.st_size, stat.st_mtime, gender, speaker, digits, repetition,
+                         soundfile.info(path).duration))
+    manifest = np.array(rows, dtype=MANIFEST_DTYPE)
+    manifest = manifest[np.argsort(manifest['path'])]
+    np.save(filename, manifest)
+    return manifest
+
+
+def loadManifest(filename, root=None):
+    """ Reads a manifest, building it from root if it does not exist yet """
+    if not os.path.exists(filename) and root is not None:
+        return updateManifest(filename, root)
+    return np.load(filename)
+
+
+def queryManifest(manifest, speaker=None, gender=None, digit=None):
+    """ Selects the entries of a manifest
+
+    Args:
+       manifest: structured array, see updateManifest
+       speaker: speaker ID (or list of IDs) to keep
+       gender: 'man', 'woman', 'boy' or 'girl' (or a list)
+       digit: keep the utterances containing this digit symbol
+
+    Output:
+       the matching rows of the manifest
+    """
+    keep = np.ones(len(manifest), dtype=bool)
+    if speaker is not None:
+        keep &= np.isin(manifest['speaker'], speaker)
+    if gender is not None:
+        keep &= np.isin(manifest['gender'], gender)
+    if digit is not None:
+        keep &= np.char.find(manifest['digits'], digit) >= 0
+    return manifest[keep]
+
+
+def manifestIndex(manifest):
+    """ Dictionary from path to manifest row, to look up the metadata of a file """
+    return {row['path']: row for row in manifest}
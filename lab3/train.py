@@ -24,7 +24,7 @@ print("Hidden_U:"+str(sys.argv[3]))
 print("Batch_size:"+str(sys.argv[4]))
 print("Epoch:"+str(sys.argv[5]))
 
-train, validation = get_training_and_validation_sets(np.load('train_data.npz')['data'])
+train, validation = get_training_and_validation_sets(np.load('train_data.npz')['data'], np.load('train_manifest.npy'))
 # Standarrdize dataset
 train = standardize_per_utterance(train)
 validation = standardize_per_utterance(validation)